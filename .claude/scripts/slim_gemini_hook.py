@@ -7,7 +7,7 @@ Optimized for Claude Code token savings with essential analysis only
 import os
 import subprocess
 import sys
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 # Model configuration with environment variable support
 GEMINI_MODELS = {
@@ -24,12 +24,9 @@ HOOK_MODEL_ASSIGNMENTS = {
 
 # Configuration
 
-# File analysis configuration optimized for token efficiency
-SLIM_CONFIG = {
-    "max_file_size": 81920,  # 80 KB
-    "max_lines": 800,  # Maximum lines per file
-    "response_word_limit": 800,  # Maximum words in response
-    "supported_extensions": [
+# Supported file extensions (frozenset for O(1) membership checks)
+SUPPORTED_EXTENSIONS = frozenset(
+    {
         ".py",
         ".js",
         ".ts",
@@ -44,7 +41,15 @@ SLIM_CONFIG = {
         ".sass",
         ".jsx",
         ".tsx",  # Frontend files
-    ],
+    }
+)
+
+# File analysis configuration optimized for token efficiency
+SLIM_CONFIG = {
+    "max_file_size": 81920,  # 80 KB
+    "max_lines": 800,  # Maximum lines per file
+    "response_word_limit": 800,  # Maximum words in response
+    "supported_extensions": SUPPORTED_EXTENSIONS,
 }
 
 # File validation
@@ -54,29 +59,31 @@ def should_analyze_file(file_path: str) -> tuple[bool, str]:
     """Determine if file should be analyzed based on slim configuration"""
 
     try:
-        path = Path(file_path)
-
-        # Check if file exists
-        if not path.exists():
+        # Check if file exists (single stat, reused for the size check)
+        try:
+            file_stat = os.stat(file_path)
+        except FileNotFoundError:
             return False, "File not found"
 
         # Check file extension
-        if path.suffix.lower() not in SLIM_CONFIG["supported_extensions"]:
+        if os.path.splitext(file_path)[1].lower() not in SUPPORTED_EXTENSIONS:
             return False, "File type not supported"
 
         # Check file size (80KB limit)
-        file_size = path.stat().st_size
+        file_size = file_stat.st_size
         if file_size > SLIM_CONFIG["max_file_size"]:
             return False, f"File too large ({file_size} bytes)"
 
-        # Check line count (800 line limit)
+        # Check line count (800 line limit), stopping as soon as it is exceeded
+        max_lines = SLIM_CONFIG["max_lines"]
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                line_count = sum(1 for _ in f)
-
-            if line_count > SLIM_CONFIG["max_lines"]:
-                return False, f"Too many lines ({line_count})"
-        except Exception:
+            with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+                line_count = 0
+                for _ in f:
+                    line_count += 1
+                    if line_count > max_lines:
+                        return False, f"Too many lines (>{max_lines})"
+        except OSError:
             # If can't read file, skip analysis
             return False, "Cannot read file"
 
@@ -92,10 +99,14 @@ def should_analyze_file(file_path: str) -> tuple[bool, str]:
 def execute_gemini_analysis(analysis_type: str, file_paths: str):
     """Execute Gemini CLI analysis with model selection and token-efficient prompts"""
 
-    # Validate and filter file paths
+    # Validate and filter file paths (I/O bound, so check them concurrently).
+    # Drop duplicates first, keeping the original order.
+    paths = list(dict.fromkeys(file_paths.split()))
+    with ThreadPoolExecutor(max_workers=min(16, len(paths) or 1)) as executor:
+        checks = list(executor.map(should_analyze_file, paths))
+
     valid_files = []
-    for file_path in file_paths.split():
-        should_analyze, reason = should_analyze_file(file_path)
+    for file_path, (should_analyze, reason) in zip(paths, checks):
         if should_analyze:
             valid_files.append(file_path)
         else:
@@ -130,40 +141,25 @@ def execute_gemini_analysis(analysis_type: str, file_paths: str):
             bufsize=1,
         )
 
-        # Stream output and show progress
-        output_lines = []
         print(f"🔍 {analysis_type} analysis in progress...", file=sys.stderr)
 
-        while True:
-            line = process.stdout.readline()
-            if line:
-                output_lines.append(line)
-                # Show progress to stderr
-                print(
-                    f"📝 {line.strip()[:80]}{'...' if len(line.strip()) > 80 else ''}",
-                    file=sys.stderr,
-                )
-            elif process.poll() is not None:
-                break
-
-        # Get remaining output
-        remaining_stdout, stderr = process.communicate()
-        if remaining_stdout:
-            output_lines.append(remaining_stdout)
-
-        # Create result object to match original interface
-        result = subprocess.CompletedProcess(
-            args=["gemini", "-p", prompt],
-            returncode=process.returncode,
-            stdout="".join(output_lines),
-            stderr=stderr,
-        )
+        # Drain stderr on a worker thread so a chatty CLI cannot fill the pipe
+        # and block while we are still reading stdout
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            stderr_future = executor.submit(process.stderr.read)
+
+            # Pass output straight through as it arrives instead of buffering it
+            for line in process.stdout:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+
+            stderr = stderr_future.result()
+        process.wait()
 
-        if result.returncode == 0:
+        if process.returncode == 0:
             print(f"✅ {analysis_type} analysis complete", file=sys.stderr)
-            print(result.stdout)
         else:
-            print(f"⚠️ Analysis failed: {result.stderr}", file=sys.stderr)
+            print(f"⚠️ Analysis failed: {stderr}", file=sys.stderr)
 
     # No timeout handling needed with streaming
     except FileNotFoundError:
@@ -192,41 +188,26 @@ def execute_session_summary(directory_path: str):
         process = subprocess.Popen(
             ["gemini", "-m", model_name, "-p", prompt],
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            # stderr is never shown here, so don't let it fill an unread pipe
+            stderr=subprocess.DEVNULL,
             text=True,
             bufsize=1,
         )
 
-        # Stream output
-        output_lines = []
-
-        while True:
-            line = process.stdout.readline()
-            if line:
-                output_lines.append(line)
-            elif process.poll() is not None:
-                break
-
-        # Get remaining output
-        remaining_stdout, stderr = process.communicate()
-        if remaining_stdout:
-            output_lines.append(remaining_stdout)
-
-        # Create result object
-        result = subprocess.CompletedProcess(
-            args=["gemini", "-p", prompt],
-            returncode=process.returncode,
-            stdout="".join(output_lines),
-            stderr=stderr,
-        )
+        print("\n" + "=" * 50, file=sys.stderr)
+        print("📋 SESSION SUMMARY", file=sys.stderr)
+        print("=" * 50, file=sys.stderr)
 
-        if result.returncode == 0:
+        # Pass output straight through as it arrives instead of buffering it
+        for line in process.stdout:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+
+        process.wait()
+
+        print("=" * 50, file=sys.stderr)
+        if process.returncode == 0:
             print("✅ Session summary complete", file=sys.stderr)
-            print("\n" + "=" * 50, file=sys.stderr)
-            print("📋 SESSION SUMMARY", file=sys.stderr)
-            print("=" * 50, file=sys.stderr)
-            print(result.stdout)
-            print("=" * 50, file=sys.stderr)
         else:
             print("⚠️ Session summary failed", file=sys.stderr)
 
@@ -237,12 +218,7 @@ def execute_session_summary(directory_path: str):
 
 # Prompt generation
 
-
-def create_pre_edit_prompt(file_paths: list) -> str:
-    """Create token-efficient pre-edit analysis prompt"""
-    files_list = ", ".join(file_paths)
-
-    return f"""Perform comprehensive pre-edit analysis of these files: {files_list}
+PRE_EDIT_PROMPT = """Perform comprehensive pre-edit analysis of these files: {files_list}
 
 Provide detailed analysis including:
 1. Critical bugs or security vulnerabilities
@@ -255,12 +231,7 @@ Provide detailed analysis including:
 
 Focus on actionable insights that will help make better edits on first attempt."""
 
-
-def create_pre_commit_prompt(file_paths: list) -> str:
-    """Create focused pre-commit review prompt"""
-    files_list = ", ".join(file_paths)
-
-    return f"""Comprehensive pre-commit review of these files: {files_list}
+PRE_COMMIT_PROMPT = """Comprehensive pre-commit review of these files: {files_list}
 
 Perform thorough analysis including:
 1. Critical bugs that would break functionality
@@ -273,10 +244,22 @@ Perform thorough analysis including:
 
 Focus on issues that should block this commit. Be thorough and detailed."""
 
+SESSION_SUMMARY_PROMPT = "What can you see in this current directory? List the main files and give a brief project overview in under 200 words in plain text format."
+
+
+def create_pre_edit_prompt(file_paths: list) -> str:
+    """Create token-efficient pre-edit analysis prompt"""
+    return PRE_EDIT_PROMPT.format(files_list=", ".join(file_paths))
+
+
+def create_pre_commit_prompt(file_paths: list) -> str:
+    """Create focused pre-commit review prompt"""
+    return PRE_COMMIT_PROMPT.format(files_list=", ".join(file_paths))
+
 
 def create_session_summary_prompt(directory_path: str) -> str:
     """Create lightweight session summary prompt"""
-    return "What can you see in this current directory? List the main files and give a brief project overview in under 200 words in plain text format."
+    return SESSION_SUMMARY_PROMPT
 
 
 # Main execution
@@ -4,11 +4,19 @@ Gemini CLI Helper - Direct integration with API fallback
 Usage: python gemini_helper.py [command] [args]
 """
 
+import codecs
+import hashlib
 import os
-import shlex
+import queue
+import re
+import shutil
+import sqlite3
+import stat
 import subprocess
 import sys
+import threading
 import time
+from contextlib import closing
 from pathlib import Path
 from typing import IO, Any, Dict, Optional, Union
 
@@ -21,6 +29,19 @@ GEMINI_MODELS = {
 # API key for direct API usage
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
+# Minimal environment for the CLI subprocess, built once instead of per call.
+# Include GOOGLE_CLOUD_PROJECT if it's set
+_CLI_ENV = {"PATH": os.environ.get("PATH", "")}
+if "GOOGLE_CLOUD_PROJECT" in os.environ:
+    _CLI_ENV["GOOGLE_CLOUD_PROJECT"] = os.environ["GOOGLE_CLOUD_PROJECT"]
+
+# Gemini CLI executable, resolved against PATH once (None if not installed)
+_GEMINI_BIN = shutil.which("gemini", path=_CLI_ENV["PATH"])
+
+# GenerativeModel instances by model name, reused so that successive API
+# calls share the client's connection instead of setting up a new one
+_MODEL_CACHE: Dict[str, Any] = {}
+
 # Model assignment for tasks
 MODEL_ASSIGNMENTS = {
     "quick_query": "flash",  # Simple Q&A
@@ -32,8 +53,115 @@ MODEL_ASSIGNMENTS = {
 MAX_FILE_SIZE = 81920  # 80KB
 MAX_LINES = 800
 
+# File types accepted by analyze_code
+ALLOWED_EXTENSIONS = frozenset(
+    {
+        ".py",
+        ".js",
+        ".ts",
+        ".java",
+        ".cpp",
+        ".c",
+        ".rs",
+        ".vue",
+        ".html",
+        ".css",
+        ".scss",
+        ".sass",
+        ".jsx",
+        ".tsx",
+        ".json",
+        ".yaml",
+        ".toml",
+        ".md",
+        ".txt",
+    }
+)
+
+# Persistent response cache: seconds to keep entries (0 disables caching)
+RESPONSE_CACHE_TTL = int(os.getenv("GEMINI_RESPONSE_CACHE_TTL", "0"))
+RESPONSE_CACHE_PATH = Path.home() / ".cache" / "gemini_helper" / "responses.db"
+
+# Prompt templates. The static instructions come first and the per-call
+# values last, so repeated calls share a prompt prefix that the provider
+# can cache.
+ANALYZE_CODE_PROMPT = """Provide comprehensive analysis including:
+1. Code structure and organization
+2. Logic flow and algorithm efficiency
+3. Security considerations and vulnerabilities
+4. Performance implications and optimizations
+5. Error handling and edge cases
+6. Code quality and maintainability
+7. Best practices compliance
+8. Specific recommendations for improvements
+
+Be thorough and provide actionable insights.
+
+Perform a {analysis_type} analysis of this code:
+
+{code}"""
+
+ANALYZE_CODEBASE_PROMPT = """Provide comprehensive analysis including:
+1. Overall architecture and design patterns
+2. Code quality and maintainability assessment
+3. Security considerations and potential vulnerabilities
+4. Performance implications and bottlenecks
+5. Best practices adherence and improvement suggestions
+6. Dependencies and integration points
+7. Testing coverage and quality assurance
+8. Documentation and code clarity
+
+Be thorough and detailed in your analysis. Focus on actionable insights and recommendations.
+
+Analyze this codebase in directory '{directory}' (scope: {analysis_scope})."""
+
+USAGE = """Usage:
+  python gemini_helper.py query 'your question here' [context]
+  python gemini_helper.py analyze file_path [analysis_type]
+  python gemini_helper.py codebase directory_path [scope]
+"""
+
 
 # Security functions
+
+# Common prompt injection prefixes/suffixes, matched in a single regex pass
+DANGEROUS_PATTERNS = (
+    "ignore all previous instructions",
+    "forget everything above",
+    "new instruction:",
+    "system:",
+    "assistant:",
+    "user:",
+    "###",
+    "---",
+    "```",
+    "<|",
+    "|>",
+    "[INST]",
+    "[/INST]",
+)
+_DANGEROUS_RE = re.compile(
+    "|".join(re.escape(pattern) for pattern in DANGEROUS_PATTERNS), re.IGNORECASE
+)
+
+# C0 control characters (except tab, newline and carriage return) and DEL,
+# removed in one str.translate pass
+_CTRL_TABLE = dict.fromkeys([*(c for c in range(32) if c not in (9, 10, 13)), 127])
+# Matches any character in _CTRL_TABLE, to skip the translate copy on clean text
+_CTRL_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+
+# Model names passed to the CLI: ASCII alphanumerics, dots and hyphens only,
+# bounded in length
+_MODEL_NAME_RE = re.compile(r"[A-Za-z0-9.-]{1,64}")
+
+# Credential patterns scrubbed from error messages
+_SECRET_PATTERNS = (
+    (re.compile(r"AIzaSy[A-Za-z0-9_-]{33}"), "[API_KEY_REDACTED]"),
+    (re.compile(r"sk-[A-Za-z0-9_-]{32,}"), "[API_KEY_REDACTED]"),
+    (re.compile(r"Bearer [A-Za-z0-9_.-]{10,}"), "[TOKEN_REDACTED]"),
+)
+
+
 def sanitize_for_prompt(text: str, max_length: int = 100000) -> str:
     """Sanitize text input to prevent prompt injection attacks"""
     if not isinstance(text, str):
@@ -43,37 +171,12 @@ def sanitize_for_prompt(text: str, max_length: int = 100000) -> str:
     if len(text) > max_length:
         text = text[:max_length]
 
-    # Remove/escape potential prompt injection patterns
-    # Remove common prompt injection prefixes/suffixes
-    dangerous_patterns = [
-        "ignore all previous instructions",
-        "forget everything above",
-        "new instruction:",
-        "system:",
-        "assistant:",
-        "user:",
-        "###",
-        "---",
-        "```",
-        "<|",
-        "|>",
-        "[INST]",
-        "[/INST]",
-    ]
-
-    text_lower = text.lower()
-    for pattern in dangerous_patterns:
-        if pattern.lower() in text_lower:
-            # Replace with safe alternative (case-insensitive)
-            import re
-
-            # Create case-insensitive regex pattern
-            escaped_pattern = re.escape(pattern)
-            replacement = f"[filtered-content]"
-            text = re.sub(escaped_pattern, replacement, text, flags=re.IGNORECASE)
-
-    # Escape potential control characters
-    text = text.replace("\x00", "").replace("\x1b", "")
+    # Strip control characters first so they cannot split a dangerous pattern
+    if _CTRL_RE.search(text):
+        text = text.translate(_CTRL_TABLE)
+
+    # Remove/escape potential prompt injection patterns (case-insensitive)
+    text = _DANGEROUS_RE.sub("[filtered-content]", text)
 
     return text
 
@@ -96,8 +199,10 @@ def execute_gemini_api(
         if show_progress:
             print(f"🌟 Making API call to {model_name}...", file=sys.stderr)
 
-        genai.configure(api_key=GOOGLE_API_KEY)
-        model = genai.GenerativeModel(model_name)
+        model = _MODEL_CACHE.get(model_name)
+        if model is None:
+            genai.configure(api_key=GOOGLE_API_KEY)
+            model = _MODEL_CACHE[model_name] = genai.GenerativeModel(model_name)
 
         response = model.generate_content(prompt)
 
@@ -117,17 +222,8 @@ def execute_gemini_api(
         # Sanitize error message to prevent sensitive information leakage
         error_message = str(e)
         # Remove potential API key patterns from error messages
-        import re
-
-        error_message = re.sub(
-            r"AIzaSy[A-Za-z0-9_-]{33}", "[API_KEY_REDACTED]", error_message
-        )
-        error_message = re.sub(
-            r"sk-[A-Za-z0-9_-]{32,}", "[API_KEY_REDACTED]", error_message
-        )
-        error_message = re.sub(
-            r"Bearer [A-Za-z0-9_.-]{10,}", "[TOKEN_REDACTED]", error_message
-        )
+        for secret_re, replacement in _SECRET_PATTERNS:
+            error_message = secret_re.sub(replacement, error_message)
 
         if show_progress:
             print(
@@ -137,12 +233,20 @@ def execute_gemini_api(
         return {"success": False, "error": error_message}
 
 
+def _read_pipe(pipe: IO[bytes], chunks: "queue.Queue[Optional[bytes]]") -> None:
+    """Forward a pipe's output to a queue as it arrives, then None at EOF"""
+    try:
+        with pipe:
+            while chunk := pipe.read1(65536):  # type: ignore[attr-defined]
+                chunks.put(chunk)
+    finally:
+        chunks.put(None)
+
+
 def execute_gemini_cli(
     prompt: str, model_name: Optional[str] = None, show_progress: bool = True
 ) -> Dict[str, Any]:
     """Execute Gemini CLI with real-time streaming output"""
-    import time
-
     try:
         # Input validation
         if not isinstance(prompt, str) or len(prompt.strip()) == 0:
@@ -159,88 +263,158 @@ def execute_gemini_cli(
             if not isinstance(model_name, str) or not model_name.strip():
                 return {"success": False, "error": "Invalid model name"}
             # Basic sanitization: only allow alphanumeric, dots, hyphens
-            if not all(c.isalnum() or c in ".-" for c in model_name):
+            if not _MODEL_NAME_RE.fullmatch(model_name):
                 return {"success": False, "error": "Invalid model name characters"}
 
         # Build command args safely (no shell=True)  # noqa: B602
-        cmd_args = ["gemini"]
+        if _GEMINI_BIN is None:
+            return {
+                "success": False,
+                "error": "Gemini CLI not found. Run 'npm install -g @google/gemini-cli'",
+            }
+        cmd_args = [_GEMINI_BIN]
         if model_name:
             cmd_args.extend(["-m", model_name])
         cmd_args.extend(["-p", prompt])
 
         if show_progress:
-            print("🔍 Starting Gemini CLI analysis...", file=sys.stderr)
-            print(f"📝 Prompt length: {len(prompt)} characters", file=sys.stderr)
-            print("⏳ Streaming output:", file=sys.stderr)
-            print("-" * 50, file=sys.stderr)
+            sys.stderr.write(
+                "🔍 Starting Gemini CLI analysis...\n"
+                f"📝 Prompt length: {len(prompt)} characters\n"
+                "⏳ Streaming output:\n" + "-" * 50 + "\n"
+            )
 
         # Use Popen for real-time streaming - SECURE VERSION (no shell=True)  # noqa: B602
-        # Include GOOGLE_CLOUD_PROJECT if it's set
-        env = {"PATH": os.environ.get("PATH", "")}
-        if "GOOGLE_CLOUD_PROJECT" in os.environ:
-            env["GOOGLE_CLOUD_PROJECT"] = os.environ["GOOGLE_CLOUD_PROJECT"]
 
         process = subprocess.Popen(
             cmd_args,
             shell=False,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,  # Line buffered
-            universal_newlines=True,
-            env=env,  # Include necessary environment variables
+            env=_CLI_ENV,  # Include necessary environment variables
             cwd=None,  # Use current working directory
         )
 
-        output_lines = []
-        start_time = time.time()
-        last_progress = time.time()
+        # Pipes are read on background threads (select() only handles
+        # sockets on Windows). stderr is drained concurrently so a full pipe
+        # cannot stall the CLI, and stdout chunks are queued so the heartbeat
+        # keeps ticking while the CLI is silent.
+        stdout_chunks: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        stderr_chunks: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        for pipe, chunks in (
+            (process.stdout, stdout_chunks),
+            (process.stderr, stderr_chunks),
+        ):
+            threading.Thread(
+                target=_read_pipe, args=(pipe, chunks), daemon=True
+            ).start()
+
+        # Only used to echo output as it arrives; the result is decoded once
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        output = bytearray()
+        start_time = time.monotonic()
+        last_progress = start_time
 
         # Stream output in real-time
         while True:
-            if process.stdout is not None:
-                line = process.stdout.readline()
+            try:
+                chunk = stdout_chunks.get(timeout=1.0)
+            except queue.Empty:
+                pass
             else:
-                line = ""
-            if line:
-                output_lines.append(line)
+                if chunk is None:
+                    break
+                output += chunk
                 if show_progress:
                     # Show real-time output
-                    print(line.rstrip(), flush=True)
-                last_progress = time.time()  # Reset timer when we get output
-            elif process.poll() is not None:
-                break
+                    sys.stdout.write(decoder.decode(chunk))
+                    sys.stdout.flush()
+                last_progress = time.monotonic()  # Reset timer on output
 
             # Show progress every 15 seconds when no output
-            if show_progress and time.time() - last_progress > 15:
-                elapsed = int(time.time() - start_time)
-                print(
-                    f"\n⏱️  Analysis in progress... {elapsed}s elapsed", file=sys.stderr
-                )
-                last_progress = time.time()  # Reset timer
-
-        # Get any remaining output
-        remaining_stdout, stderr = process.communicate()
-        if remaining_stdout:
-            output_lines.append(remaining_stdout)
             if show_progress:
-                print(remaining_stdout.rstrip(), flush=True)
-
-        full_output = "".join(output_lines)
+                now = time.monotonic()
+                if now - last_progress > 15:
+                    elapsed = int(now - start_time)
+                    print(
+                        f"\n⏱️  Analysis in progress... {elapsed}s elapsed",
+                        file=sys.stderr,
+                    )
+                    last_progress = now  # Reset timer
+
+        stderr_output = b"".join(iter(stderr_chunks.get, None))
+        process.wait()
+        full_output = output.decode("utf-8", errors="replace")
 
         if show_progress:
+            sys.stdout.write(decoder.decode(b"", final=True))
             print("-" * 50, file=sys.stderr)
             print("✅ Analysis complete!", file=sys.stderr)
 
         if process.returncode == 0:
             return {"success": True, "output": full_output}
         else:
-            return {"success": False, "error": stderr}
+            return {
+                "success": False,
+                "error": stderr_output.decode("utf-8", errors="replace"),
+            }
 
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 
+def _open_response_cache() -> Optional[sqlite3.Connection]:
+    """Open the response cache and drop expired entries (None when disabled)"""
+    if RESPONSE_CACHE_TTL <= 0:
+        return None
+    try:
+        # Cached responses may quote analysed code, so keep them private
+        RESPONSE_CACHE_PATH.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        conn = sqlite3.connect(RESPONSE_CACHE_PATH)
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, output TEXT NOT NULL, ts REAL NOT NULL)"
+            )
+            conn.execute(
+                "DELETE FROM responses WHERE ts < ?",
+                (time.time() - RESPONSE_CACHE_TTL,),
+            )
+        return conn
+    except (OSError, sqlite3.Error):
+        return None
+
+
+def _response_cache_key(model_name: str, prompt: str) -> str:
+    """Hash model and prompt into a cache key"""
+    return hashlib.sha256(
+        f"{model_name}\0{prompt}".encode("utf-8", errors="surrogatepass")
+    ).hexdigest()
+
+
+def _cache_get(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    """Return a cached response, or None on a miss"""
+    try:
+        row = conn.execute(
+            "SELECT output FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+
+def _cache_put(conn: sqlite3.Connection, key: str, output: str) -> None:
+    """Store a successful response"""
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, output, ts) VALUES (?, ?, ?)",
+                (key, output, time.time()),
+            )
+    except sqlite3.Error:
+        pass
+
+
 def execute_gemini_smart(
     prompt: str, task_type: str = "quick_query", show_progress: bool = True
 ) -> dict:
@@ -254,7 +428,26 @@ def execute_gemini_smart(
         print(f"📝 Task: {task_type}", file=sys.stderr)
         print(f"🤖 Selected model: {model_name} ({model_type})", file=sys.stderr)
 
-    # Try API first if key is available
+    cache = _open_response_cache()
+    if cache is None:
+        return _execute_uncached(prompt, model_name, show_progress)
+
+    with closing(cache):
+        cache_key = _response_cache_key(model_name, prompt)
+        cached_output = _cache_get(cache, cache_key)
+        if cached_output is not None:
+            if show_progress:
+                print("💾 Using cached response", file=sys.stderr)
+            return {"success": True, "output": cached_output, "cached": True}
+
+        result = _execute_uncached(prompt, model_name, show_progress)
+        if result["success"]:
+            _cache_put(cache, cache_key, result["output"])
+        return result
+
+
+def _execute_uncached(prompt: str, model_name: str, show_progress: bool) -> dict:
+    """Try the API first if a key is available, then fall back to the CLI"""
     if GOOGLE_API_KEY:
         if show_progress:
             print("🚀 Attempting direct API call...", file=sys.stderr)
@@ -334,28 +527,7 @@ def analyze_code(file_path: str, analysis_type: str = "comprehensive") -> None:
                 return
 
             # Check file extension for allowed types
-            allowed_extensions = {
-                ".py",
-                ".js",
-                ".ts",
-                ".java",
-                ".cpp",
-                ".c",
-                ".rs",
-                ".vue",
-                ".html",
-                ".css",
-                ".scss",
-                ".sass",
-                ".jsx",
-                ".tsx",
-                ".json",
-                ".yaml",
-                ".toml",
-                ".md",
-                ".txt",
-            }
-            if resolved_path.suffix.lower() not in allowed_extensions:
+            if resolved_path.suffix.lower() not in ALLOWED_EXTENSIONS:
                 print(f"Error: File type not supported: {resolved_path.suffix}")
                 return
 
@@ -365,42 +537,43 @@ def analyze_code(file_path: str, analysis_type: str = "comprehensive") -> None:
             print(f"Error: Path validation failed: {str(e)}")
             return
 
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
+        # The limit is in bytes, so read at most one byte past it instead of
+        # the whole file
+        with open(file_path, "rb") as f:
+            raw = f.read(MAX_FILE_SIZE + 1)
+            file_size = os.fstat(f.fileno()).st_size
 
-        if len(content) > MAX_FILE_SIZE:
+        if len(raw) > MAX_FILE_SIZE:
             print(
-                f"Warning: File too large ({len(content)} bytes). Truncating to {MAX_FILE_SIZE} bytes..."
+                f"Warning: File too large ({file_size} bytes). Truncating to {MAX_FILE_SIZE} bytes..."
+            )
+            # A non-final decode drops a multi-byte character cut at the limit
+            content = codecs.getincrementaldecoder("utf-8")().decode(
+                raw[:MAX_FILE_SIZE]
             )
-            content = content[:MAX_FILE_SIZE]
+        else:
+            content = raw.decode("utf-8")
+        # Match text-mode reads, which translate \r\n and \r to \n
+        if "\r" in content:
+            content = content.replace("\r\n", "\n").replace("\r", "\n")
 
-        line_count = len(content.splitlines())
+        line_count = content.count("\n") + (
+            1 if content and not content.endswith("\n") else 0
+        )
         if line_count > MAX_LINES:
             print(
                 f"Warning: Too many lines ({line_count}). Truncating to {MAX_LINES} lines..."
             )
-            lines = content.splitlines()[:MAX_LINES]
-            content = "\n".join(lines)
+            # Split only as far as the limit instead of into every line
+            content = "\n".join(content.split("\n", MAX_LINES)[:MAX_LINES])
 
         # Sanitize inputs to prevent prompt injection
         sanitized_content = sanitize_for_prompt(content, max_length=MAX_FILE_SIZE)
         # analysis_type is already validated above
 
-        prompt = f"""Perform a {analysis_type} analysis of this code:
-
-{sanitized_content}
-
-Provide comprehensive analysis including:
-1. Code structure and organization
-2. Logic flow and algorithm efficiency
-3. Security considerations and vulnerabilities
-4. Performance implications and optimizations
-5. Error handling and edge cases
-6. Code quality and maintainability
-7. Best practices compliance
-8. Specific recommendations for improvements
-
-Be thorough and provide actionable insights."""
+        prompt = ANALYZE_CODE_PROMPT.format(
+            analysis_type=analysis_type, code=sanitized_content
+        )
 
         result = execute_gemini_smart(prompt, "analyze_code")
 
@@ -450,11 +623,14 @@ def analyze_codebase(directory_path: str, analysis_scope: str = "all") -> None:
             )
             return
 
-        if not resolved_path.exists():
+        # Single stat call covers both the existence and directory checks
+        try:
+            path_stat = os.stat(resolved_path)
+        except (FileNotFoundError, NotADirectoryError):
             print(f"Error: Directory not found: {directory_path}")
             return
 
-        if not resolved_path.is_dir():
+        if not stat.S_ISDIR(path_stat.st_mode):
             print(f"Error: Path is not a directory: {directory_path}")
             return
 
@@ -465,19 +641,9 @@ def analyze_codebase(directory_path: str, analysis_scope: str = "all") -> None:
         print(f"Error: Path validation failed: {str(e)}")
         return
 
-    prompt = f"""Analyze this codebase in directory '{safe_dir_name}' (scope: {analysis_scope}):
-
-Provide comprehensive analysis including:
-1. Overall architecture and design patterns
-2. Code quality and maintainability assessment
-3. Security considerations and potential vulnerabilities
-4. Performance implications and bottlenecks
-5. Best practices adherence and improvement suggestions
-6. Dependencies and integration points
-7. Testing coverage and quality assurance
-8. Documentation and code clarity
-
-Be thorough and detailed in your analysis. Focus on actionable insights and recommendations."""
+    prompt = ANALYZE_CODEBASE_PROMPT.format(
+        directory=safe_dir_name, analysis_scope=analysis_scope
+    )
 
     result = execute_gemini_smart(prompt, "analyze_codebase")
 
@@ -493,10 +659,7 @@ Be thorough and detailed in your analysis. Focus on actionable insights and reco
 def main() -> None:
     """Main CLI interface"""
     if len(sys.argv) < 2:
-        print("Usage:")
-        print("  python gemini_helper.py query 'your question here' [context]")
-        print("  python gemini_helper.py analyze file_path [analysis_type]")
-        print("  python gemini_helper.py codebase directory_path [scope]")
+        sys.stdout.write(USAGE)
         return
 
     command = sys.argv[1].lower()
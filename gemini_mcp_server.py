@@ -4,11 +4,15 @@ Slim Gemini CLI MCP Server
 """
 
 import asyncio
+import hashlib
 import logging
 import os
-import shlex
-import subprocess
+import random
+import re
+import stat
 import sys
+import traceback
+from collections import OrderedDict
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Union
 
@@ -27,8 +31,106 @@ server: Server = Server("slim-gemini-cli-mcp")
 MAX_FILE_SIZE = 81920  # 80KB
 MAX_LINES = 800
 
+# Prompt templates. The static instructions come first and the per-call
+# values last, so repeated calls share a prompt prefix that the provider
+# can cache.
+ANALYZE_CODE_PROMPT = """Provide comprehensive analysis including:
+1. Code structure and organization
+2. Logic flow and algorithm efficiency
+3. Security considerations and vulnerabilities
+4. Performance implications and optimizations
+5. Error handling and edge cases
+6. Code quality and maintainability
+7. Best practices compliance
+8. Specific recommendations for improvements
+
+CRITICAL FORMATTING: Output ONLY plain text. Do NOT use:
+- No ### headers or ** bold text or * italics
+- No --- separators or bullet points
+- No markdown formatting whatsoever
+- No special characters for emphasis
+Write exactly like a plain text document. Use simple numbered points and paragraph breaks only.
+
+Perform a {analysis_type} analysis of this code:
+
+{code}"""
+
+ANALYZE_CODEBASE_PROMPT = """Provide comprehensive analysis including:
+1. Overall architecture and design patterns
+2. Code quality and maintainability assessment
+3. Security considerations and potential vulnerabilities
+4. Performance implications and bottlenecks
+5. Best practices adherence and improvement suggestions
+6. Dependencies and integration points
+7. Testing coverage and quality assurance
+8. Documentation and code clarity
+
+MANDATORY PLAIN TEXT FORMAT - NO EXCEPTIONS:
+Output must be 100% plain text. Do NOT use:
+### (pound signs) ** (asterisks) --- (dashes) * (stars)
+Do NOT create headers or bold text
+Do NOT use any special symbols for formatting
+Write like a simple text file with only:
+- Regular paragraphs
+- Numbered points (1. 2. 3.)
+- Line breaks between sections
+Terminal cannot display markdown - use only plain characters
+
+Analyze this codebase in directory '{directory}' (scope: {analysis_scope})."""
+
+# Quick-query templates, with and without caller-supplied context
+_QUICK_QUERY_INSTRUCTIONS = "Provide a concise answer in plain text format. Do not use markdown formatting. Break content into clear paragraphs when needed. Format your response like a helpful AI assistant would - clear, well-structured, and easy to read with proper line breaks between ideas."
+QUICK_QUERY_PROMPT = "Question: {query}\n\n" + _QUICK_QUERY_INSTRUCTIONS
+QUICK_QUERY_CONTEXT_PROMPT = "Context: {context}\n\n" + QUICK_QUERY_PROMPT
+
 
 # Security functions - prevent prompt injection and path traversal attacks
+
+# C0 control characters (except tab, newline and carriage return) and DEL,
+# removed in one str.translate pass
+_CTRL_TABLE = dict.fromkeys([*(c for c in range(32) if c not in (9, 10, 13)), 127])
+# Matches any character in _CTRL_TABLE, to skip the translate copy on clean text
+_CTRL_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+
+# Model names passed to the CLI: ASCII alphanumerics, dots and hyphens only,
+# bounded in length
+_MODEL_NAME_RE = re.compile(r"[A-Za-z0-9.-]{1,64}")
+
+# Common prompt injection prefixes/suffixes, matched in a single regex pass
+DANGEROUS_PATTERNS = (
+    "ignore all previous instructions",
+    "forget everything above",
+    "new instruction:",
+    "system:",
+    "assistant:",
+    "user:",
+    "###",
+    "---",
+    "```",
+    "<|",
+    "|>",
+    "[INST]",
+    "[/INST]",
+)
+_DANGEROUS_RE = re.compile(
+    "|".join(re.escape(pattern) for pattern in DANGEROUS_PATTERNS), re.IGNORECASE
+)
+
+# Credential patterns scrubbed from error messages and CLI stderr
+_SECRET_PATTERNS = (
+    (re.compile(r"AIzaSy[A-Za-z0-9_-]{25,}"), "[API_KEY_REDACTED]"),
+    (re.compile(r"sk-[A-Za-z0-9_-]{32,}"), "[API_KEY_REDACTED]"),
+    (re.compile(r"Bearer [A-Za-z0-9_.-]{10,}"), "[TOKEN_REDACTED]"),
+)
+
+
+def redact_secrets(text: str) -> str:
+    """Replace API keys and bearer tokens with redaction markers"""
+    for secret_re, replacement in _SECRET_PATTERNS:
+        text = secret_re.sub(replacement, text)
+    return text
+
+
 def sanitize_for_prompt(text: str, max_length: int = 100000) -> str:
     """Sanitize text input to prevent prompt injection attacks"""
     if not isinstance(text, str):
@@ -38,36 +140,12 @@ def sanitize_for_prompt(text: str, max_length: int = 100000) -> str:
     if len(text) > max_length:
         text = text[:max_length]
 
-    # Remove/escape potential prompt injection patterns
-    dangerous_patterns = [
-        "ignore all previous instructions",
-        "forget everything above",
-        "new instruction:",
-        "system:",
-        "assistant:",
-        "user:",
-        "###",
-        "---",
-        "```",
-        "<|",
-        "|>",
-        "[INST]",
-        "[/INST]",
-    ]
-
-    text_lower = text.lower()
-    for pattern in dangerous_patterns:
-        if pattern.lower() in text_lower:
-            # Replace with safe alternative (case-insensitive)
-            import re
-
-            # Create case-insensitive regex pattern
-            escaped_pattern = re.escape(pattern)
-            replacement = f"[filtered-content]"
-            text = re.sub(escaped_pattern, replacement, text, flags=re.IGNORECASE)
-
-    # Escape potential control characters
-    text = text.replace("\x00", "").replace("\x1b", "")
+    # Strip control characters first so they cannot split a dangerous pattern
+    if _CTRL_RE.search(text):
+        text = text.translate(_CTRL_TABLE)
+
+    # Remove/escape potential prompt injection patterns (case-insensitive)
+    text = _DANGEROUS_RE.sub("[filtered-content]", text)
 
     return text
 
@@ -118,6 +196,34 @@ GEMINI_MODELS = {
 # API key for direct API usage
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
+# Minimal environment for the CLI subprocess, built once instead of per call.
+# Include GOOGLE_CLOUD_PROJECT if it's set
+_CLI_ENV = {"PATH": os.environ.get("PATH", "")}
+if "GOOGLE_CLOUD_PROJECT" in os.environ:
+    _CLI_ENV["GOOGLE_CLOUD_PROJECT"] = os.environ["GOOGLE_CLOUD_PROJECT"]
+
+# Linux rejects any single argv string over 128KB (MAX_ARG_STRLEN), so larger
+# prompts are piped to the CLI's stdin instead of being passed with -p
+MAX_ARGV_PROMPT_BYTES = 100 * 1024
+STDIN_CHUNK_SIZE = 64 * 1024
+
+# Upper bound on CLI output kept in memory; the CLI is stopped past this
+MAX_OUTPUT_BYTES = int(os.getenv("GEMINI_MAX_OUTPUT", str(16 * 1024 * 1024)))
+# Longest single output line the stream reader accepts (asyncio default: 64KB)
+STREAM_LINE_LIMIT = 1024 * 1024
+
+# Maximum number of model calls (API or CLI) in flight at once
+MAX_CONCURRENT_CALLS = max(1, int(os.getenv("GEMINI_MCP_CONCURRENCY", "8")))
+_call_slots = asyncio.Semaphore(MAX_CONCURRENT_CALLS)
+
+# Attempts per API call for transient errors, with exponential backoff
+API_MAX_ATTEMPTS = 3
+API_RETRY_BASE_DELAY = 1.0  # seconds
+
+# GenerativeModel instances by model name, reused so that successive API
+# calls share the client's connection instead of setting up a new one
+_MODEL_CACHE: Dict[str, Any] = {}
+
 # Model assignment for tasks
 MODEL_ASSIGNMENTS = {
     "gemini_quick_query": "flash",  # Simple Q&A
@@ -128,6 +234,28 @@ MODEL_ASSIGNMENTS = {
     "session_summary": "flash",  # Lightweight overview
 }
 
+# In-memory LRU cache of successful responses (0 disables caching)
+RESPONSE_CACHE_SIZE = int(os.getenv("GEMINI_RESPONSE_CACHE_SIZE", "0"))
+_response_cache: "OrderedDict[bytes, str]" = OrderedDict()
+
+
+def _response_cache_key(model_name: str, prompt: str) -> bytes:
+    """Hash model and prompt into a compact cache key"""
+    return hashlib.blake2b(
+        f"{model_name}\0{prompt}".encode("utf-8", errors="surrogatepass"),
+        digest_size=16,
+    ).digest()
+
+
+def _cache_response(key: Optional[bytes], output: str) -> None:
+    """Store a successful response, evicting the least recently used entries"""
+    if key is None:
+        return
+    _response_cache[key] = output
+    _response_cache.move_to_end(key)
+    while len(_response_cache) > RESPONSE_CACHE_SIZE:
+        _response_cache.popitem(last=False)
+
 
 async def execute_gemini_api(prompt: str, model_name: str) -> Dict[str, Any]:
     """Execute Gemini API directly with specified model"""
@@ -141,12 +269,39 @@ async def execute_gemini_api(prompt: str, model_name: str) -> Dict[str, Any]:
             return {"success": False, "error": "Invalid or missing API key"}
 
         import google.generativeai as genai
+        from google.api_core import exceptions as google_exceptions
+
+        model = _MODEL_CACHE.get(model_name)
+        if model is None:
+            genai.configure(api_key=GOOGLE_API_KEY)
+            model = _MODEL_CACHE[model_name] = genai.GenerativeModel(model_name)
+
+        # Rate limits, server errors and timeouts are worth retrying before
+        # falling back to the much slower CLI
+        retryable = (
+            google_exceptions.ResourceExhausted,
+            google_exceptions.InternalServerError,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.DeadlineExceeded,
+        )
 
-        genai.configure(api_key=GOOGLE_API_KEY)
-        model = genai.GenerativeModel(model_name)
-
-        logger.info(f"Making API call to {model_name}")
-        response = await model.generate_content_async(prompt)
+        logger.info("Making API call to %s", model_name)
+        for attempt in range(1, API_MAX_ATTEMPTS + 1):
+            try:
+                response = await model.generate_content_async(prompt)
+                break
+            except retryable as e:
+                if attempt == API_MAX_ATTEMPTS:
+                    raise
+                delay = (
+                    API_RETRY_BASE_DELAY * 2 ** (attempt - 1) * (0.5 + random.random())
+                )
+                logger.warning(
+                    "Transient API error (%s), retrying in %.1fs",
+                    type(e).__name__,
+                    delay,
+                )
+                await asyncio.sleep(delay)
 
         return {"success": True, "output": response.text}
 
@@ -156,96 +311,101 @@ async def execute_gemini_api(prompt: str, model_name: str) -> Dict[str, Any]:
     except Exception as e:
         # Sanitize error message to prevent sensitive information leakage
         error_message = str(e)
-        import re
+        error_message = redact_secrets(error_message)
 
-        error_message = re.sub(
-            r"AIzaSy[A-Za-z0-9_-]{25,}", "[API_KEY_REDACTED]", error_message
-        )
-        error_message = re.sub(
-            r"sk-[A-Za-z0-9_-]{32,}", "[API_KEY_REDACTED]", error_message
-        )
-        error_message = re.sub(
-            r"Bearer [A-Za-z0-9_.-]{10,}", "[TOKEN_REDACTED]", error_message
-        )
-
-        logger.error(f"API call failed: {error_message}")
+        logger.error("API call failed: %s", error_message)
         return {"success": False, "error": error_message}
 
 
-@server.list_tools()  # type: ignore
-async def list_tools() -> List[Tool]:
-    """List available tools"""
-    return [
-        Tool(
-            name="gemini_quick_query",
-            description="Ask Gemini CLI any development question for quick answers",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "query": {
-                        "type": "string",
-                        "description": "Question to ask Gemini CLI",
-                    },
-                    "context": {
-                        "type": "string",
-                        "description": "Optional context to provide with the query",
-                    },
+# Tool definitions are static, so build them once at import
+_TOOLS: List[Tool] = [
+    Tool(
+        name="gemini_quick_query",
+        description="Ask Gemini CLI any development question for quick answers",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "Question to ask Gemini CLI",
+                },
+                "context": {
+                    "type": "string",
+                    "description": "Optional context to provide with the query",
                 },
-                "required": ["query"],
             },
-        ),
-        Tool(
-            name="gemini_analyze_code",
-            description="Analyze specific code sections with focused insights",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "code_content": {
-                        "type": "string",
-                        "description": "Code content to analyze",
-                    },
-                    "analysis_type": {
-                        "type": "string",
-                        "enum": [
-                            "comprehensive",
-                            "security",
-                            "performance",
-                            "architecture",
-                        ],
-                        "default": "comprehensive",
-                        "description": "Type of analysis to perform",
-                    },
+            "required": ["query"],
+        },
+    ),
+    Tool(
+        name="gemini_analyze_code",
+        description="Analyze specific code sections with focused insights",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "code_content": {
+                    "type": "string",
+                    "maxLength": MAX_FILE_SIZE,
+                    "description": "Code content to analyze",
+                },
+                "analysis_type": {
+                    "type": "string",
+                    "enum": [
+                        "comprehensive",
+                        "security",
+                        "performance",
+                        "architecture",
+                    ],
+                    "default": "comprehensive",
+                    "description": "Type of analysis to perform",
                 },
-                "required": ["code_content"],
             },
-        ),
-        Tool(
-            name="gemini_codebase_analysis",
-            description="Analyze entire directories using Gemini CLI's 1M token context",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "directory_path": {
-                        "type": "string",
-                        "description": "Path to directory to analyze",
-                    },
-                    "analysis_scope": {
-                        "type": "string",
-                        "enum": [
-                            "structure",
-                            "security",
-                            "performance",
-                            "patterns",
-                            "all",
-                        ],
-                        "default": "all",
-                        "description": "Scope of analysis",
-                    },
+            "required": ["code_content"],
+        },
+    ),
+    Tool(
+        name="gemini_codebase_analysis",
+        description="Analyze entire directories using Gemini CLI's 1M token context",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "directory_path": {
+                    "type": "string",
+                    "description": "Path to directory to analyze",
+                },
+                "analysis_scope": {
+                    "type": "string",
+                    "enum": [
+                        "structure",
+                        "security",
+                        "performance",
+                        "patterns",
+                        "all",
+                    ],
+                    "default": "all",
+                    "description": "Scope of analysis",
                 },
-                "required": ["directory_path"],
             },
-        ),
-    ]
+            "required": ["directory_path"],
+        },
+    ),
+]
+
+
+# Allowed enum values, taken from the tool schemas so they cannot drift apart
+_TOOL_SCHEMAS = {tool.name: tool.inputSchema for tool in _TOOLS}
+_ANALYSIS_TYPES = frozenset(
+    _TOOL_SCHEMAS["gemini_analyze_code"]["properties"]["analysis_type"]["enum"]
+)
+_ANALYSIS_SCOPES = frozenset(
+    _TOOL_SCHEMAS["gemini_codebase_analysis"]["properties"]["analysis_scope"]["enum"]
+)
+
+
+@server.list_tools()  # type: ignore
+async def list_tools() -> List[Tool]:
+    """List available tools"""
+    return list(_TOOLS)
 
 
 async def execute_gemini_cli_streaming(
@@ -261,8 +421,8 @@ async def execute_gemini_cli_streaming(
     if len(prompt.strip()) == 0:
         return {"success": False, "error": "Invalid prompt: must be non-empty string"}
 
-    logger.info(f"Prompt length: {len(prompt)} characters")
-    logger.info(f"Task type: {task_type}")
+    logger.info("Prompt length: %d characters", len(prompt))
+    logger.info("Task type: %s", task_type)
 
     if len(prompt) > 1000000:  # 1MB limit
         return {"success": False, "error": "Prompt too large (max 1MB)"}
@@ -277,11 +437,54 @@ async def execute_gemini_cli_streaming(
     # Validate model name
     if not isinstance(model_name, str) or not model_name.strip():
         return {"success": False, "error": "Invalid model name"}
-    if not all(c.isalnum() or c in ".-" for c in model_name):
+    if not _MODEL_NAME_RE.fullmatch(model_name):
         return {"success": False, "error": "Invalid model name characters"}
 
-    logger.info(f"Selected model: {model_name} ({model_type})")
+    # The prompt digest doubles as the cache key and a stable request ID that
+    # ties together the log lines of concurrent calls
+    prompt_key = _response_cache_key(model_name, prompt)
+    request_id = prompt_key.hex()[:8]
+    logger.info(
+        "Request %s: selected model %s (%s)", request_id, model_name, model_type
+    )
+
+    # Serve repeated prompts from the response cache when it is enabled
+    cache_key = None
+    if RESPONSE_CACHE_SIZE > 0:
+        cache_key = prompt_key
+        cached_output = _response_cache.get(cache_key)
+        if cached_output is not None:
+            _response_cache.move_to_end(cache_key)
+            logger.info("Request %s: returning cached response", request_id)
+            return {"success": True, "output": cached_output, "cached": True}
+
+    # Cache hits above skip the limit; only live model calls wait for a slot
+    async with _call_slots:
+        result = await _execute_uncached(prompt, model_name)
+    logger.info("Request %s: finished (success=%s)", request_id, result["success"])
+    if result["success"]:
+        _cache_response(cache_key, result["output"])
+    return result
+
+
+async def _stop_process(process: asyncio.subprocess.Process) -> None:
+    """Terminate a CLI process and reap it, killing it if it ignores SIGTERM"""
+    try:
+        process.terminate()
+    except ProcessLookupError:
+        pass
+    try:
+        await asyncio.wait_for(process.wait(), timeout=5)
+    except asyncio.TimeoutError:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        await process.wait()
+
 
+async def _execute_uncached(prompt: str, model_name: str) -> Dict[str, Any]:
+    """Run a prompt through the API, falling back to the Gemini CLI"""
     try:
         # Try API first if key is available
         if GOOGLE_API_KEY:
@@ -292,309 +495,317 @@ async def execute_gemini_cli_streaming(
             logger.warning("API call failed, falling back to CLI")
 
         # Fallback to CLI - SECURE VERSION (no shell=True)  # noqa: B602
-        cmd_args = ["gemini", "-m", model_name, "-p", prompt]
-        logger.info(
-            f"Executing command: gemini -m {model_name} -p [prompt length: {len(prompt)}]"
-        )
-
-        # Include GOOGLE_CLOUD_PROJECT if it's set
-        env = {"PATH": os.environ.get("PATH", "")}
-        if "GOOGLE_CLOUD_PROJECT" in os.environ:
-            env["GOOGLE_CLOUD_PROJECT"] = os.environ["GOOGLE_CLOUD_PROJECT"]
+        prompt_bytes = prompt.encode("utf-8")
+        use_stdin = len(prompt_bytes) > MAX_ARGV_PROMPT_BYTES
+        if use_stdin:
+            # Without -p the CLI reads the prompt from its (non-TTY) stdin
+            cmd_args = ["gemini", "-m", model_name]
+            logger.info(
+                "Executing command: gemini -m %s < [prompt length: %d]",
+                model_name,
+                len(prompt),
+            )
+        else:
+            cmd_args = ["gemini", "-m", model_name, "-p", prompt]
+            logger.info(
+                "Executing command: gemini -m %s -p [prompt length: %d]",
+                model_name,
+                len(prompt),
+            )
 
         process = await asyncio.create_subprocess_exec(
             *cmd_args,
+            stdin=asyncio.subprocess.PIPE if use_stdin else None,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
-            env=env,  # Include necessary environment variables
+            env=_CLI_ENV,  # Include necessary environment variables
+            limit=STREAM_LINE_LIMIT,
         )
-        logger.info(f"Process created with PID: {process.pid}")
-
-        output_lines = []
-        start_time = asyncio.get_event_loop().time()
-        last_progress = start_time
+        logger.info("Process created with PID: %s", process.pid)
 
-        logger.info("Streaming Gemini CLI output...")
-
-        # Stream output in real-time
-        while True:
-            try:
-                # Read line with timeout to check for progress
-                if process.stdout is not None:
-                    line = await asyncio.wait_for(
-                        process.stdout.readline(), timeout=1.0
-                    )
-                else:
-                    line = b""
-                if line:
-                    decoded_line = line.decode("utf-8", errors="replace")
-                    output_lines.append(decoded_line)
-                    logger.info(
-                        f"Gemini output: {decoded_line.strip()[:100]}{'...' if len(decoded_line.strip()) > 100 else ''}"
+        try:
+            if use_stdin and process.stdin is not None:
+                for offset in range(0, len(prompt_bytes), STDIN_CHUNK_SIZE):
+                    process.stdin.write(
+                        prompt_bytes[offset : offset + STDIN_CHUNK_SIZE]
                     )
-                    last_progress = asyncio.get_event_loop().time()
-                elif process.returncode is not None:
-                    break
-            except asyncio.TimeoutError:
-                # Check if process is still running and show progress
-                if process.returncode is None:
-                    current_time = asyncio.get_event_loop().time()
-                    if current_time - last_progress > 15:
+                    await process.stdin.drain()
+                process.stdin.close()
+
+            output = bytearray()
+            loop = asyncio.get_running_loop()
+            start_time = loop.time()
+            last_progress = start_time
+
+            logger.info("Streaming Gemini CLI output...")
+
+            async def report_progress() -> None:
+                # Log a heartbeat whenever the CLI has been silent for 15 seconds
+                while True:
+                    await asyncio.sleep(15)
+                    current_time = loop.time()
+                    if current_time - last_progress >= 15:
                         elapsed = int(current_time - start_time)
-                        logger.info(f"Analysis in progress... {elapsed}s elapsed")
-                        last_progress = current_time
-                else:
-                    break
+                        logger.info("Analysis in progress... %ds elapsed", elapsed)
+
+            # Stream output in real-time; the heartbeat runs as a separate task so
+            # reads are not interrupted by a polling timeout
+            heartbeat = asyncio.create_task(report_progress())
+            # Per-line previews are debug-only; the output is decoded once
+            log_lines = logger.isEnabledFor(logging.DEBUG)
+            try:
+                while process.stdout is not None:
+                    line = await process.stdout.readline()
+                    if not line:
+                        break
+                    output += line
+                    if len(output) > MAX_OUTPUT_BYTES:
+                        break
+                    if log_lines:
+                        logger.debug(
+                            "Gemini output: %.100s",
+                            line[:100].decode("utf-8", errors="replace").rstrip(),
+                        )
+                    last_progress = loop.time()
             except (BrokenPipeError, OSError):
                 # Process crashed, try to get stderr
                 logger.warning("Process output stream broken, checking for crash")
-                break
+            finally:
+                heartbeat.cancel()
+
+            if len(output) > MAX_OUTPUT_BYTES:
+                logger.error(
+                    "Gemini CLI output exceeded %d bytes, stopping", MAX_OUTPUT_BYTES
+                )
+                return {
+                    "success": False,
+                    "error": f"Output exceeded {MAX_OUTPUT_BYTES} bytes",
+                }
+
+            # Get any remaining output
+            remaining_stdout, stderr = await process.communicate()
+            if remaining_stdout:
+                output += remaining_stdout
+                if log_lines:
+                    logger.debug(
+                        "Final output: %.100s",
+                        remaining_stdout[:100]
+                        .decode("utf-8", errors="replace")
+                        .rstrip(),
+                    )
 
-        # Get any remaining output
-        remaining_stdout, stderr = await process.communicate()
-        if remaining_stdout:
-            decoded_remaining = remaining_stdout.decode("utf-8", errors="replace")
-            output_lines.append(decoded_remaining)
-            logger.info(
-                f"Final output: {decoded_remaining.strip()[:100]}{'...' if len(decoded_remaining.strip()) > 100 else ''}"
-            )
+            full_output = output.decode("utf-8", errors="replace")
 
-        full_output = "".join(output_lines)
-        stderr_str = stderr.decode("utf-8", errors="replace") if stderr else ""
+            logger.info("Process completed with return code: %s", process.returncode)
+            logger.info("Total output length: %d chars", len(full_output))
 
-        logger.info(f"Process completed with return code: {process.returncode}")
-        logger.info(f"Total output length: {len(full_output)} chars")
+            if process.returncode == 0:
+                logger.info("Gemini CLI execution successful")
+                return {"success": True, "output": full_output}
+            else:
+                # stderr is only needed on failure, so decode it here
+                stderr_str = stderr.decode("utf-8", errors="replace") if stderr else ""
 
-        if process.returncode == 0:
-            logger.info("Gemini CLI execution successful")
-            return {"success": True, "output": full_output}
-        else:
-            # Sanitize stderr to prevent sensitive information leakage
-            import re
+                # Sanitize stderr to prevent sensitive information leakage
+                sanitized_stderr = redact_secrets(stderr_str)
 
-            sanitized_stderr = re.sub(
-                r"AIzaSy[A-Za-z0-9_-]{25,}", "[API_KEY_REDACTED]", stderr_str
-            )
-            sanitized_stderr = re.sub(
-                r"sk-[A-Za-z0-9_-]{32,}", "[API_KEY_REDACTED]", sanitized_stderr
-            )
-            sanitized_stderr = re.sub(
-                r"Bearer [A-Za-z0-9_.-]{10,}", "[TOKEN_REDACTED]", sanitized_stderr
-            )
+                logger.error(
+                    "Gemini CLI failed with return code %s: %.200s...",
+                    process.returncode,
+                    sanitized_stderr,
+                )
+                return {"success": False, "error": sanitized_stderr}
 
-            logger.error(
-                f"Gemini CLI failed with return code {process.returncode}: {sanitized_stderr[:200]}..."
-            )
-            return {"success": False, "error": sanitized_stderr}
+        finally:
+            # Never leave the CLI running when we stop reading early or fail
+            if process.returncode is None:
+                await _stop_process(process)
 
     except Exception as e:
-        logger.error(f"Exception during Gemini CLI execution: {str(e)}")
+        logger.error("Exception during Gemini CLI execution: %s", e)
         return {"success": False, "error": str(e)}
 
 
-@server.call_tool()  # type: ignore
-async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
-    logger.info(f"Tool call received: {name} with arguments: {list(arguments.keys())}")
-    logger.debug(f"Full arguments: {arguments}")
-    try:
-        if name == "gemini_quick_query":
-            query = arguments.get("query", "")
-            context = arguments.get("context", "")
-
-            # Input validation and sanitization
-            if not isinstance(query, str) or not query.strip():
-                return [
-                    TextContent(
-                        type="text", text="Error: Query must be a non-empty string"
-                    )
-                ]
+async def _handle_quick_query(arguments: Dict[str, Any]) -> List[TextContent]:
+    """Handle gemini_quick_query tool calls"""
+    query = arguments.get("query", "")
+    context = arguments.get("context", "")
 
-            if not isinstance(context, str):
-                return [
-                    TextContent(type="text", text="Error: Context must be a string")
-                ]
+    # Input validation and sanitization
+    if not isinstance(query, str) or not query.strip():
+        return [
+            TextContent(type="text", text="Error: Query must be a non-empty string")
+        ]
 
-            # Sanitize inputs to prevent prompt injection
-            sanitized_query = sanitize_for_prompt(query, max_length=10000)
-            sanitized_context = sanitize_for_prompt(context, max_length=50000)
+    if not isinstance(context, str):
+        return [TextContent(type="text", text="Error: Context must be a string")]
 
-            prompt = (
-                f"Context: {sanitized_context}\n\nQuestion: {sanitized_query}\n\nProvide a concise answer in plain text format. Do not use markdown formatting. Break content into clear paragraphs when needed. Format your response like a helpful AI assistant would - clear, well-structured, and easy to read with proper line breaks between ideas."
-                if sanitized_context
-                else f"Question: {sanitized_query}\n\nProvide a concise answer in plain text format. Do not use markdown formatting. Break content into clear paragraphs when needed. Format your response like a helpful AI assistant would - clear, well-structured, and easy to read with proper line breaks between ideas."
-            )
+    # Sanitize inputs to prevent prompt injection
+    sanitized_query = sanitize_for_prompt(query, max_length=10000)
+    sanitized_context = sanitize_for_prompt(context, max_length=50000)
 
-            result = await execute_gemini_cli_streaming(prompt, "gemini_quick_query")
+    if sanitized_context:
+        prompt = QUICK_QUERY_CONTEXT_PROMPT.format(
+            context=sanitized_context, query=sanitized_query
+        )
+    else:
+        prompt = QUICK_QUERY_PROMPT.format(query=sanitized_query)
 
-            if result["success"]:
-                return [TextContent(type="text", text=result["output"])]
-            else:
-                return [
-                    TextContent(type="text", text=f"Query failed: {result['error']}")
-                ]
-
-        elif name == "gemini_analyze_code":
-            code_content = arguments.get("code_content", "")
-            analysis_type = arguments.get("analysis_type", "comprehensive")
-
-            # Input validation
-            if not isinstance(code_content, str) or not code_content.strip():
-                return [
-                    TextContent(
-                        type="text",
-                        text="Error: Code content must be a non-empty string",
-                    )
-                ]
-
-            if not isinstance(analysis_type, str) or analysis_type not in [
-                "comprehensive",
-                "security",
-                "performance",
-                "architecture",
-            ]:
-                return [TextContent(type="text", text="Error: Invalid analysis type")]
-
-            if len(code_content) > MAX_FILE_SIZE:
-                return [
-                    TextContent(
-                        type="text",
-                        text=f"⚠️ Code too large ({len(code_content)} bytes). Max: {MAX_FILE_SIZE} bytes",
-                    )
-                ]
-
-            line_count = len(code_content.splitlines())
-            if line_count > MAX_LINES:
-                return [
-                    TextContent(
-                        type="text",
-                        text=f"⚠️ Too many lines ({line_count}). Max: {MAX_LINES} lines",
-                    )
-                ]
+    result = await execute_gemini_cli_streaming(prompt, "gemini_quick_query")
 
-            # Sanitize inputs to prevent prompt injection
-            sanitized_code = sanitize_for_prompt(code_content, max_length=MAX_FILE_SIZE)
+    if result["success"]:
+        return [TextContent(type="text", text=result["output"])]
+    else:
+        return [TextContent(type="text", text=f"Query failed: {result['error']}")]
 
-            prompt = f"""Perform a {analysis_type} analysis of this code:
 
-{sanitized_code}
+async def _handle_analyze_code(arguments: Dict[str, Any]) -> List[TextContent]:
+    """Handle gemini_analyze_code tool calls"""
+    code_content = arguments.get("code_content", "")
+    analysis_type = arguments.get("analysis_type", "comprehensive")
 
-Provide comprehensive analysis including:
-1. Code structure and organization
-2. Logic flow and algorithm efficiency
-3. Security considerations and vulnerabilities
-4. Performance implications and optimizations
-5. Error handling and edge cases
-6. Code quality and maintainability
-7. Best practices compliance
-8. Specific recommendations for improvements
+    # Input validation
+    if not isinstance(code_content, str) or not code_content.strip():
+        return [
+            TextContent(
+                type="text",
+                text="Error: Code content must be a non-empty string",
+            )
+        ]
+
+    if not isinstance(analysis_type, str) or analysis_type not in _ANALYSIS_TYPES:
+        return [TextContent(type="text", text="Error: Invalid analysis type")]
+
+    # The limit is in UTF-8 bytes. Every character takes at least one byte, so
+    # only non-ASCII text within the character limit needs encoding to measure
+    code_size = len(code_content)
+    size_is_exact = code_content.isascii()
+    if code_size <= MAX_FILE_SIZE and not size_is_exact:
+        code_size = len(code_content.encode("utf-8", errors="surrogatepass"))
+        size_is_exact = True
+    if code_size > MAX_FILE_SIZE:
+        size_text = (
+            f"{code_size} bytes" if size_is_exact else f"at least {code_size} bytes"
+        )
+        return [
+            TextContent(
+                type="text",
+                text=f"⚠️ Code too large ({size_text}). Max: {MAX_FILE_SIZE} bytes",
+            )
+        ]
+
+    # Count lines like text mode would read them, whatever the line endings
+    code_content = code_content.replace("\r\n", "\n").replace("\r", "\n")
+    line_count = code_content.count("\n") + (
+        1 if code_content and not code_content.endswith("\n") else 0
+    )
+    if line_count > MAX_LINES:
+        return [
+            TextContent(
+                type="text",
+                text=f"⚠️ Too many lines ({line_count}). Max: {MAX_LINES} lines",
+            )
+        ]
 
-CRITICAL FORMATTING: Output ONLY plain text. Do NOT use:
-- No ### headers or ** bold text or * italics
-- No --- separators or bullet points
-- No markdown formatting whatsoever
-- No special characters for emphasis
-Write exactly like a plain text document. Use simple numbered points and paragraph breaks only."""
+    # Sanitize inputs to prevent prompt injection
+    sanitized_code = sanitize_for_prompt(code_content, max_length=MAX_FILE_SIZE)
 
-            result = await execute_gemini_cli_streaming(prompt, "gemini_analyze_code")
+    prompt = ANALYZE_CODE_PROMPT.format(
+        analysis_type=analysis_type, code=sanitized_code
+    )
 
-            if result["success"]:
-                return [TextContent(type="text", text=result["output"])]
-            else:
-                return [
-                    TextContent(type="text", text=f"Analysis failed: {result['error']}")
-                ]
-
-        elif name == "gemini_codebase_analysis":
-            directory_path = arguments.get("directory_path", "")
-            analysis_scope = arguments.get("analysis_scope", "all")
-
-            # Input validation
-            if not isinstance(directory_path, str) or not directory_path.strip():
-                return [
-                    TextContent(
-                        type="text",
-                        text="Error: Directory path must be a non-empty string",
-                    )
-                ]
+    result = await execute_gemini_cli_streaming(prompt, "gemini_analyze_code")
 
-            if not isinstance(analysis_scope, str) or analysis_scope not in [
-                "structure",
-                "security",
-                "performance",
-                "patterns",
-                "all",
-            ]:
-                return [TextContent(type="text", text="Error: Invalid analysis scope")]
+    if result["success"]:
+        return [TextContent(type="text", text=result["output"])]
+    else:
+        return [TextContent(type="text", text=f"Analysis failed: {result['error']}")]
 
-            logger.info(
-                f"Initiating codebase analysis for directory: {directory_path} with scope: {analysis_scope}"
+
+async def _handle_codebase_analysis(arguments: Dict[str, Any]) -> List[TextContent]:
+    """Handle gemini_codebase_analysis tool calls"""
+    directory_path = arguments.get("directory_path", "")
+    analysis_scope = arguments.get("analysis_scope", "all")
+
+    # Input validation
+    if not isinstance(directory_path, str) or not directory_path.strip():
+        return [
+            TextContent(
+                type="text",
+                text="Error: Directory path must be a non-empty string",
             )
+        ]
 
-            # Path security validation
-            is_valid, error_msg, resolved_path = validate_path_security(directory_path)
-            if not is_valid or resolved_path is None:
-                return [TextContent(type="text", text=f"❌ {error_msg}")]
+    if not isinstance(analysis_scope, str) or analysis_scope not in _ANALYSIS_SCOPES:
+        return [TextContent(type="text", text="Error: Invalid analysis scope")]
 
-            if not resolved_path.exists():
-                return [
-                    TextContent(
-                        type="text", text=f"❌ Directory not found: {directory_path}"
-                    )
-                ]
+    logger.info(
+        "Initiating codebase analysis for directory: %s with scope: %s",
+        directory_path,
+        analysis_scope,
+    )
 
-            if not resolved_path.is_dir():
-                return [
-                    TextContent(
-                        type="text",
-                        text=f"❌ Path is not a directory: {directory_path}",
-                    )
-                ]
+    # Path security validation
+    is_valid, error_msg, resolved_path = validate_path_security(directory_path)
+    if not is_valid or resolved_path is None:
+        return [TextContent(type="text", text=f"❌ {error_msg}")]
 
-            # Use sanitized directory name for prompt (just the name, not full path)
-            safe_dir_name = sanitize_for_prompt(resolved_path.name, max_length=100)
+    # One stat call answers both "exists" and "is a directory"
+    try:
+        path_stat = os.stat(resolved_path)
+    except (FileNotFoundError, NotADirectoryError):
+        return [
+            TextContent(type="text", text=f"❌ Directory not found: {directory_path}")
+        ]
+
+    if not stat.S_ISDIR(path_stat.st_mode):
+        return [
+            TextContent(
+                type="text",
+                text=f"❌ Path is not a directory: {directory_path}",
+            )
+        ]
 
-            prompt = f"""Analyze this codebase in directory '{safe_dir_name}' (scope: {analysis_scope}):
+    # Use sanitized directory name for prompt (just the name, not full path)
+    safe_dir_name = sanitize_for_prompt(resolved_path.name, max_length=100)
 
-Provide comprehensive analysis including:
-1. Overall architecture and design patterns
-2. Code quality and maintainability assessment
-3. Security considerations and potential vulnerabilities
-4. Performance implications and bottlenecks
-5. Best practices adherence and improvement suggestions
-6. Dependencies and integration points
-7. Testing coverage and quality assurance
-8. Documentation and code clarity
+    prompt = ANALYZE_CODEBASE_PROMPT.format(
+        directory=safe_dir_name, analysis_scope=analysis_scope
+    )
+    logger.info("Constructed prompt for Gemini CLI (length: %d chars)", len(prompt))
 
-MANDATORY PLAIN TEXT FORMAT - NO EXCEPTIONS:
-Output must be 100% plain text. Do NOT use:
-### (pound signs) ** (asterisks) --- (dashes) * (stars)
-Do NOT create headers or bold text
-Do NOT use any special symbols for formatting
-Write like a simple text file with only:
-- Regular paragraphs
-- Numbered points (1. 2. 3.)
-- Line breaks between sections
-Terminal cannot display markdown - use only plain characters"""
-            logger.info(
-                f"Constructed prompt for Gemini CLI (length: {len(prompt)} chars)"
-            )
+    result = await execute_gemini_cli_streaming(prompt, "gemini_codebase_analysis")
 
-            result = await execute_gemini_cli_streaming(
-                prompt, "gemini_codebase_analysis"
-            )
+    if result["success"]:
+        return [TextContent(type="text", text=result["output"])]
+    else:
+        return [TextContent(type="text", text=f"Analysis failed: {result['error']}")]
 
-            if result["success"]:
-                return [TextContent(type="text", text=result["output"])]
-            else:
-                return [
-                    TextContent(type="text", text=f"Analysis failed: {result['error']}")
-                ]
 
-        else:
+# Tool name -> handler dispatch table
+_TOOL_HANDLERS = {
+    "gemini_quick_query": _handle_quick_query,
+    "gemini_analyze_code": _handle_analyze_code,
+    "gemini_codebase_analysis": _handle_codebase_analysis,
+}
+
+
+# The handlers run their own size and enum checks. Schema validation in the
+# mcp layer would reject oversized input first, echoing it back in the error.
+@server.call_tool(validate_input=False)
+async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
+    logger.info(
+        "Tool call received: %s with arguments: %s", name, list(arguments.keys())
+    )
+    logger.debug("Full arguments: %s", arguments)
+    try:
+        handler = _TOOL_HANDLERS.get(name)
+        if handler is None:
             return [TextContent(type="text", text=f"Unknown tool: {name}")]
+        return await handler(arguments)
 
     except Exception as e:
-        logger.error(f"Error in tool {name}: {str(e)}")
+        logger.error("Error in tool %s: %s", name, e)
         return [TextContent(type="text", text=f"Error: {str(e)}")]
 
 
@@ -608,11 +819,15 @@ async def main() -> None:
                 read_stream, write_stream, server.create_initialization_options()
             )
     except Exception as e:
-        logger.error(f"Server error: {str(e)}")
-        import traceback
-
+        logger.error("Server error: %s", e)
         traceback.print_exc()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # Prefer uvloop's libuv-based event loop when it is installed
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
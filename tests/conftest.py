@@ -176,6 +176,21 @@ def patch_imports() -> Generator[None, None, None]:
         yield
 
 
+@pytest.fixture(autouse=True)
+def clear_model_cache() -> Generator[None, None, None]:
+    """
+    Drop cached GenerativeModel instances so each test sees its own genai mock.
+    """
+    import gemini_helper
+    import gemini_mcp_server
+
+    gemini_helper._MODEL_CACHE.clear()
+    gemini_mcp_server._MODEL_CACHE.clear()
+    yield
+    gemini_helper._MODEL_CACHE.clear()
+    gemini_mcp_server._MODEL_CACHE.clear()
+
+
 @pytest.fixture
 def mock_cli_execution() -> Callable[..., Dict[str, Any]]:
     """
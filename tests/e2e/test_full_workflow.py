@@ -6,6 +6,7 @@ These tests can optionally use real API calls when TEST_WITH_REAL_API=true
 
 import asyncio
 import os
+import stat
 import sys
 from pathlib import Path
 from typing import Any, Callable, cast
@@ -256,8 +257,6 @@ Missing error handling for file operations. The code will crash if the file does
             with patch("gemini_mcp_server.execute_gemini_cli_streaming") as mock_exec:
                 # Mock path validation
                 mock_path = MagicMock()
-                mock_path.exists.return_value = True
-                mock_path.is_dir.return_value = True
                 mock_path.name = "test_analysis_dir"
                 mock_validate.return_value = (True, "Valid path", mock_path)
 
@@ -286,10 +285,17 @@ Async operations are properly implemented. The streaming output handling prevent
 """,
                 }
 
-                result = await call_tool(
-                    "gemini_codebase_analysis",
-                    {"directory_path": "./test_analysis_dir", "analysis_scope": "all"},
-                )
+                with patch(
+                    "gemini_mcp_server.os.stat",
+                    return_value=MagicMock(st_mode=stat.S_IFDIR),
+                ):
+                    result = await call_tool(
+                        "gemini_codebase_analysis",
+                        {
+                            "directory_path": "./test_analysis_dir",
+                            "analysis_scope": "all",
+                        },
+                    )
 
                 assert len(result) == 1
                 response = result[0].text
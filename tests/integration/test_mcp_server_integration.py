@@ -5,14 +5,15 @@ Tests the full MCP protocol communication and tool registration
 """
 
 import asyncio
-import json
 import os
+import stat
 
 # Import our server components
 import sys
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
+from mcp import types
 from mcp.types import TextContent, Tool
 
 sys.path.insert(
@@ -132,6 +133,27 @@ class TestMCPServerIntegration:
                 assert len(result) == 1
                 assert "Test response" in result[0].text
 
+    @pytest.mark.asyncio
+    async def test_oversized_input_through_protocol_handler(self) -> None:
+        """Test that oversized input gets the short handler error, not an echo"""
+        from gemini_mcp_server import MAX_FILE_SIZE
+
+        request = types.CallToolRequest(
+            method="tools/call",
+            params=types.CallToolRequestParams(
+                name="gemini_analyze_code",
+                arguments={"code_content": "A" * (MAX_FILE_SIZE + 1)},
+            ),
+        )
+
+        handler = server.request_handlers[types.CallToolRequest]
+        result = (await handler(request)).root
+
+        assert len(result.content) == 1
+        text = result.content[0].text
+        assert "Code too large" in text
+        assert len(text) < 200
+
     @pytest.mark.asyncio
     async def test_large_input_handling(self) -> None:
         """Test handling of large inputs at integration level"""
@@ -143,6 +165,18 @@ class TestMCPServerIntegration:
         assert len(result) == 1
         assert "too large" in result[0].text.lower()
 
+        # Test that the limit counts UTF-8 bytes, not characters
+        wide_code = "# " + "\u00e9" * 50000  # 50K characters, 100KB encoded
+
+        result = await call_tool("gemini_analyze_code", {"code_content": wide_code})
+        assert len(result) == 1
+        assert "too large (100002 bytes)" in result[0].text.lower()
+
+        # Non-ASCII input over the limit in characters is not encoded to size it
+        result = await call_tool("gemini_analyze_code", {"code_content": "é" * 90000})
+        assert len(result) == 1
+        assert "too large (at least 90000 bytes)" in result[0].text.lower()
+
         # Test with too many lines
         many_lines_code = "\n".join([f"line {i}" for i in range(1000)])
 
@@ -152,6 +186,14 @@ class TestMCPServerIntegration:
         assert len(result) == 1
         assert "too many lines" in result[0].text.lower()
 
+        # Bare CR and CRLF line endings count one line per line break
+        for line_ending in ("\r", "\r\n"):
+            result = await call_tool(
+                "gemini_analyze_code", {"code_content": ("x = 1" + line_ending) * 1000}
+            )
+            assert len(result) == 1
+            assert "too many lines (1000)" in result[0].text.lower()
+
 
 class TestMCPToolFlows:
     """Test complete tool execution flows"""
@@ -218,16 +260,18 @@ def hello_world():
                     "output": "Analysis complete",
                 }
 
-                # Mock Path.exists() and Path.is_dir()
-                with patch("pathlib.Path.exists", return_value=True):
-                    with patch("pathlib.Path.is_dir", return_value=True):
-                        result = await call_tool(
-                            "gemini_codebase_analysis",
-                            {"directory_path": "./src", "analysis_scope": "security"},
-                        )
+                # Mock the directory stat
+                with patch(
+                    "gemini_mcp_server.os.stat",
+                    return_value=MagicMock(st_mode=stat.S_IFDIR),
+                ):
+                    result = await call_tool(
+                        "gemini_codebase_analysis",
+                        {"directory_path": "./src", "analysis_scope": "security"},
+                    )
 
-                        assert len(result) == 1
-                        assert "Analysis complete" in result[0].text
+                    assert len(result) == 1
+                    assert "Analysis complete" in result[0].text
 
         # Test invalid path (outside directory)
         with patch("gemini_mcp_server.validate_path_security") as mock_validate:
@@ -241,6 +285,18 @@ def hello_world():
             assert "❌" in result[0].text
             assert "outside allowed directory" in result[0].text
 
+        # Test a path whose parent is a file rather than a directory
+        with patch("gemini_mcp_server.validate_path_security") as mock_validate:
+            mock_validate.return_value = (True, "Valid path", MagicMock())
+
+            with patch("gemini_mcp_server.os.stat", side_effect=NotADirectoryError()):
+                result = await call_tool(
+                    "gemini_codebase_analysis", {"directory_path": "./setup.py/src"}
+                )
+
+            assert len(result) == 1
+            assert "Directory not found" in result[0].text
+
 
 if __name__ == "__main__":
     # Run integration tests
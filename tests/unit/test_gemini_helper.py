@@ -2,7 +2,9 @@
 """Comprehensive tests for gemini_helper.py"""
 
 import os
+import tempfile
 import unittest
+from pathlib import Path
 from unittest.mock import MagicMock, Mock, patch
 
 import pytest
@@ -13,8 +15,11 @@ from gemini_helper import (
     MAX_FILE_SIZE,
     MAX_LINES,
     MODEL_ASSIGNMENTS,
+    analyze_code,
+    analyze_codebase,
     execute_gemini_api,
     execute_gemini_cli,
+    execute_gemini_smart,
     sanitize_for_prompt,
 )
 
@@ -142,6 +147,24 @@ class TestExecuteGeminiApi(unittest.TestCase):
             self.assertTrue(result["success"])
             self.assertEqual(result["output"], "Test response")
 
+    @patch("gemini_helper.GOOGLE_API_KEY", "valid_key_123456789")
+    def test_execute_gemini_api_reuses_model(self):
+        """Test that repeated calls reuse the configured model"""
+        mock_genai = MagicMock()
+        mock_genai.GenerativeModel.return_value.generate_content.return_value.text = (
+            "Test response"
+        )
+
+        with patch.dict("sys.modules", {"google.generativeai": mock_genai}):
+            for _ in range(3):
+                result = execute_gemini_api(
+                    "test prompt", "test-model", show_progress=False
+                )
+                self.assertTrue(result["success"])
+
+        mock_genai.configure.assert_called_once_with(api_key="valid_key_123456789")
+        mock_genai.GenerativeModel.assert_called_once_with("test-model")
+
     @patch("gemini_helper.GOOGLE_API_KEY", "valid_key_123456789")
     def test_execute_gemini_api_exception_handling(self):
         """Test exception handling and error sanitization"""
@@ -195,6 +218,14 @@ class TestExecuteGeminiCli(unittest.TestCase):
         self.assertFalse(result["success"])
         self.assertIn("Invalid model name characters", result["error"])
 
+    def test_execute_gemini_cli_non_ascii_model_name(self):
+        """Test that non-ASCII letters are rejected in model names"""
+        result = execute_gemini_cli(
+            "test prompt", model_name="gemini-ｆlash", show_progress=False
+        )
+        self.assertFalse(result["success"])
+        self.assertIn("Invalid model name characters", result["error"])
+
     def test_execute_gemini_cli_valid_model_name(self):
         """Test validation of valid model name"""
         valid_names = ["gemini-pro", "gemini-2.5-flash", "model-1.0"]
@@ -212,6 +243,173 @@ class TestExecuteGeminiCli(unittest.TestCase):
                 # Should not fail on model name validation
                 self.assertTrue("Invalid model name" not in str(result))
 
+    def _fake_cli(self, script_body):
+        """Use a stand-in gemini executable for the current test"""
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        script = Path(temp_dir.name) / "gemini"
+        script.write_text(f"#!/bin/sh\n{script_body}\n")
+        script.chmod(0o755)
+        patcher = patch("gemini_helper._GEMINI_BIN", str(script))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @unittest.skipIf(os.name == "nt", "requires a POSIX shell")
+    def test_execute_gemini_cli_streams_large_output(self):
+        """Test that large stdout and stderr are both drained and decoded"""
+        self._fake_cli(
+            'i=0; while [ $i -lt 2000 ]; do echo "line $i é"; '
+            'echo "noise $i" >&2; i=$((i+1)); done'
+        )
+        result = execute_gemini_cli("test prompt", show_progress=False)
+        self.assertTrue(result["success"])
+        lines = result["output"].splitlines()
+        self.assertEqual(len(lines), 2000)
+        self.assertEqual(lines[-1], "line 1999 é")
+
+    @unittest.skipIf(os.name == "nt", "requires a POSIX shell")
+    def test_execute_gemini_cli_failure_returns_stderr(self):
+        """Test that a failing CLI reports its stderr"""
+        self._fake_cli('echo "quota exceeded" >&2; exit 3')
+        result = execute_gemini_cli("test prompt", show_progress=False)
+        self.assertFalse(result["success"])
+        self.assertEqual(result["error"].strip(), "quota exceeded")
+
+    @patch("gemini_helper._GEMINI_BIN", None)
+    @patch("subprocess.Popen")
+    def test_execute_gemini_cli_not_installed(self, mock_popen):
+        """Test that a missing CLI fails fast without spawning a process"""
+        result = execute_gemini_cli("test prompt", show_progress=False)
+        self.assertFalse(result["success"])
+        self.assertIn("Gemini CLI not found", result["error"])
+        mock_popen.assert_not_called()
+
+
+class TestResponseCache(unittest.TestCase):
+    """Test cases for the persistent response cache in execute_gemini_smart"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        cache_path = Path(self.temp_dir.name) / "cache" / "responses.db"
+        for target, value in [
+            ("gemini_helper.RESPONSE_CACHE_PATH", cache_path),
+            ("gemini_helper.RESPONSE_CACHE_TTL", 3600),
+            ("gemini_helper.GOOGLE_API_KEY", None),
+        ]:
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @patch("gemini_helper.execute_gemini_cli")
+    def test_cache_disabled_by_default(self, mock_cli):
+        """Test that every call reaches the CLI when the TTL is 0"""
+        mock_cli.return_value = {"success": True, "output": "answer"}
+        with patch("gemini_helper.RESPONSE_CACHE_TTL", 0):
+            execute_gemini_smart("prompt", show_progress=False)
+            execute_gemini_smart("prompt", show_progress=False)
+        self.assertEqual(mock_cli.call_count, 2)
+
+    @patch("gemini_helper.execute_gemini_cli")
+    def test_repeat_prompt_served_from_cache(self, mock_cli):
+        """Test that a repeated prompt is answered without calling the CLI"""
+        mock_cli.return_value = {"success": True, "output": "answer"}
+        first = execute_gemini_smart("prompt", show_progress=False)
+        second = execute_gemini_smart("prompt", show_progress=False)
+
+        self.assertEqual(mock_cli.call_count, 1)
+        self.assertEqual(first["output"], "answer")
+        self.assertNotIn("cached", first)
+        self.assertTrue(second["success"])
+        self.assertEqual(second["output"], "answer")
+        self.assertTrue(second["cached"])
+
+        # Different task types select different models, so do not share entries
+        execute_gemini_smart("prompt", "analyze_code", show_progress=False)
+        self.assertEqual(mock_cli.call_count, 2)
+
+    @patch("gemini_helper.execute_gemini_cli")
+    def test_failures_not_cached(self, mock_cli):
+        """Test that failed calls are retried rather than cached"""
+        mock_cli.return_value = {"success": False, "error": "boom"}
+        execute_gemini_smart("prompt", show_progress=False)
+        execute_gemini_smart("prompt", show_progress=False)
+        self.assertEqual(mock_cli.call_count, 2)
+
+    @patch("gemini_helper.execute_gemini_cli")
+    def test_expired_entries_ignored(self, mock_cli):
+        """Test that entries older than the TTL are not served"""
+        mock_cli.return_value = {"success": True, "output": "answer"}
+        with patch("gemini_helper.time.time", return_value=1000.0):
+            execute_gemini_smart("prompt", show_progress=False)
+        execute_gemini_smart("prompt", show_progress=False)
+        self.assertEqual(mock_cli.call_count, 2)
+
+
+class TestAnalyzeCode(unittest.TestCase):
+    """Test cases for analyze_code file handling"""
+
+    def setUp(self):
+        # analyze_code only accepts files under the working directory
+        self.temp_dir = tempfile.TemporaryDirectory(dir=".")
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def _analyze(self, data: bytes):
+        path = Path(self.temp_dir.name) / "sample.py"
+        path.write_bytes(data)
+        with (
+            patch(
+                "gemini_helper.execute_gemini_smart",
+                return_value={"success": True, "output": "ok"},
+            ) as mock_smart,
+            patch("builtins.print") as mock_print,
+        ):
+            analyze_code(str(path))
+        printed = "\n".join(str(call.args[0]) for call in mock_print.call_args_list)
+        return mock_smart.call_args[0][0], printed
+
+    def test_size_limit_counts_bytes(self):
+        """Test that non-ASCII files are truncated to MAX_FILE_SIZE bytes"""
+        prompt, printed = self._analyze("é".encode("utf-8") * MAX_FILE_SIZE)
+
+        self.assertIn("Truncating to", printed)
+        code = prompt.rsplit("\n\n", 1)[1]
+        self.assertEqual(code, "é" * (MAX_FILE_SIZE // 2))
+        self.assertLessEqual(len(code.encode("utf-8")), MAX_FILE_SIZE)
+
+    def test_empty_file_has_no_lines(self):
+        """Test that an empty file counts as zero lines, like splitlines()"""
+        _, printed = self._analyze(b"")
+
+        self.assertIn("Lines: 0", printed)
+
+    def test_crlf_line_endings_normalised(self):
+        """Test that CRLF files are read like text mode"""
+        prompt, printed = self._analyze(b"a = 1\r\nb = 2\r\n")
+
+        self.assertTrue(prompt.endswith("a = 1\nb = 2\n"))
+        self.assertIn("Lines: 2", printed)
+
+
+class TestAnalyzeCodebase(unittest.TestCase):
+    """Test cases for analyze_codebase path handling"""
+
+    def test_file_in_path_reported_as_missing(self):
+        """Test that a path through a regular file counts as not found"""
+        with tempfile.TemporaryDirectory(dir=".") as temp_dir:
+            file_path = Path(temp_dir) / "sample.py"
+            file_path.write_text("x = 1\n")
+
+            with (
+                patch("gemini_helper.execute_gemini_smart") as mock_smart,
+                patch("builtins.print") as mock_print,
+            ):
+                analyze_codebase(str(file_path / "src"))
+
+        mock_smart.assert_not_called()
+        mock_print.assert_called_once()
+        self.assertIn("Directory not found", mock_print.call_args[0][0])
+
 
 class TestConstants(unittest.TestCase):
     """Test cases for constants and configuration"""